@@ -1,7 +1,11 @@
-from flask import Flask, render_template, request
-import mysql.connector
+from flask import Flask, render_template, request, jsonify, abort
 from dotenv import load_dotenv
+from datetime import date, timedelta
+import hmac
 import os
+import re
+from db_pool import init_pool, get_db
+from query_cache import create_cache
 
 app = Flask(__name__)
 load_dotenv()  # Load .env file
@@ -13,16 +17,28 @@ db_config = {
     'host': os.getenv('DB_HOST'),
     'database': os.getenv('DB_NAME')
 }
+pool = init_pool(app, db_config)
+visit_cache = create_cache()
+# Shared secret for POST /cache/invalidate; without it only local requests may invalidate
+CACHE_INVALIDATE_TOKEN = os.getenv('CACHE_INVALIDATE_TOKEN')
 
-@app.route('/', methods=['GET', 'POST'])
-def index():
-    filter_date = request.form.get('filter_date')
-    sort_order = request.form.get('sort_order', 'ASC')
-    keyword = request.form.get('keyword')
+SEARCH_MODES = ('fulltext', 'prefix')
+FT_MIN_TOKEN_SIZE = 3  # InnoDB's default innodb_ft_min_token_size
 
-    conn = mysql.connector.connect(**db_config)
-    cursor = conn.cursor(dictionary=True)
+def fulltext_terms(keyword):
+    """Turns a keyword into a BOOLEAN MODE query requiring every word (as a prefix).
 
+    Words shorter than the full-text token size are never indexed, so they are
+    dropped; an empty result means the search has to fall back to LIKE.
+    """
+    words = [w for w in re.findall(r'\w+', keyword) if len(w) >= FT_MIN_TOKEN_SIZE]
+    return ' '.join(f'+{w}*' for w in words)
+
+def escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def build_visit_query(filter_date, keyword, sort_order, search_mode):
+    """Builds the visit search SQL so every filter can use an index on visits."""
     query = """
         SELECT v.visit_id, p.first_name, p.last_name, d.doctor_name, v.visit_date, v.diagnosis, v.notes
         FROM visits v
@@ -33,23 +49,88 @@ def index():
     params = []
 
     if filter_date:
-        query += " AND DATE(v.visit_date) = %s"
-        params.append(filter_date)
+        # Half-open range instead of DATE(v.visit_date) = ..., so idx_visit_date is usable
+        query += " AND v.visit_date >= %s AND v.visit_date < %s"
+        params.extend([filter_date, filter_date + timedelta(days=1)])
 
     if keyword:
-        query += " AND v.diagnosis LIKE %s"
-        params.append(f"%{keyword}%")
+        terms = fulltext_terms(keyword)
+        if search_mode == 'fulltext' and terms:
+            query += " AND MATCH(v.diagnosis) AGAINST (%s IN BOOLEAN MODE)"
+            params.append(terms)
+        elif search_mode == 'fulltext':
+            # Only words too short for the full-text index: keep the original match-anywhere
+            # semantics (a scan, but short terms are rare and the result is cached)
+            query += " AND v.diagnosis LIKE %s"
+            params.append(f"%{escape_like(keyword)}%")
+        else:
+            # Prefix mode: a left-anchored LIKE can range-scan idx_diagnosis
+            query += " AND v.diagnosis LIKE %s"
+            params.append(f"{escape_like(keyword)}%")
 
     query += f" ORDER BY v.visit_date {sort_order}"
+    return query, params
 
+def search_visits(day, keyword, sort_order, search_mode):
+    conn = get_db()
+    cursor = conn.cursor(dictionary=True)
+
+    query, params = build_visit_query(day, keyword, sort_order, search_mode)
     cursor.execute(query, params)
     records = cursor.fetchall()
 
     cursor.close()
-    conn.close()
+    return records
+
+def invalidate_visit_cache():
+    """Invalidation hook: call after any insert/update/delete on visits (or patients/doctors)."""
+    visit_cache.invalidate()
+
+@app.route('/', methods=['GET', 'POST'])
+def index():
+    filter_date = request.form.get('filter_date')
+    sort_order = request.form.get('sort_order', 'ASC')
+    keyword = ' '.join((request.form.get('keyword') or '').split())
+    search_mode = request.form.get('search_mode', 'fulltext')
+
+    if sort_order not in ('ASC', 'DESC'):
+        sort_order = 'ASC'
+    if search_mode not in SEARCH_MODES:
+        search_mode = 'fulltext'
+    try:
+        day = date.fromisoformat(filter_date) if filter_date else None
+    except ValueError:
+        day, filter_date = None, None
+
+    # MySQL's default collation is case-insensitive, so lowercasing doesn't change the results.
+    # The cache key and the query use the same normalized keyword, so one entry never serves another search
+    search_keyword = keyword.lower()
+    cache_key = (day.isoformat() if day else '', search_keyword, sort_order, search_mode)
+    records = visit_cache.get_or_compute(cache_key, lambda: search_visits(day, search_keyword, sort_order, search_mode))
 
     return render_template('index.html', records=records,
-                           filter_date=filter_date, sort_order=sort_order, keyword=keyword)
+                           filter_date=filter_date, sort_order=sort_order, keyword=keyword,
+                           search_mode=search_mode)
+
+@app.route('/pool-stats')
+def pool_stats():
+    return jsonify(pool.stats())
+
+@app.route('/cache-stats')
+def cache_stats():
+    return jsonify(visit_cache.stats())
+
+# Lets writers outside this process (import scripts, other services) invalidate the cache.
+# They send the X-Cache-Token header when CACHE_INVALIDATE_TOKEN is set; otherwise only localhost is allowed
+@app.route('/cache/invalidate', methods=['POST'])
+def cache_invalidate():
+    if CACHE_INVALIDATE_TOKEN:
+        if not hmac.compare_digest(request.headers.get('X-Cache-Token', ''), CACHE_INVALIDATE_TOKEN):
+            abort(403)
+    elif request.remote_addr not in ('127.0.0.1', '::1'):
+        abort(403)
+    invalidate_visit_cache()
+    return jsonify(visit_cache.stats())
 
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,150 @@
+# query_cache.py
+"""Result cache for repeated visit searches.
+
+Results are kept in an in-process LRU with a TTL by default. Setting
+VISIT_CACHE_REDIS_URL switches to a Redis-compatible server (``pip install
+redis``) so every worker shares the cache and sees the same invalidations.
+"""
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """In-process LRU cache whose entries also expire after ``ttl`` seconds."""
+
+    def __init__(self, maxsize=256, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped by clear(); a result computed before a clear is not stored afterwards
+        self._version = 0
+
+    def version(self):
+        return self._version
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, version):
+        with self._lock:
+            if version != self._version:
+                return
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._version += 1
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class RedisCache:
+    """Shared cache on a Redis-compatible server.
+
+    Keys embed a generation number; invalidating bumps the generation, so
+    every worker stops seeing old entries at once and Redis expires them.
+    """
+
+    def __init__(self, url, ttl=60, prefix='visit_search'):
+        import redis  # Optional dependency, only needed for multi-worker deployments
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def version(self):
+        return int(self.client.get(f'{self.prefix}:generation') or 0)
+
+    def _key(self, key, generation):
+        return f'{self.prefix}:{generation}:{key!r}'
+
+    def get(self, key, version):
+        raw = self.client.get(self._key(key, version))
+        return pickle.loads(raw) if raw is not None else None
+
+    def set(self, key, value, version):
+        # Stored under the generation read before the query ran: if it was invalidated
+        # meanwhile, nobody reads that generation any more and the entry just expires
+        self.client.set(self._key(key, version), pickle.dumps(value), ex=self.ttl)
+
+    def clear(self):
+        self.client.incr(f'{self.prefix}:generation')
+
+    def __len__(self):
+        return 0
+
+
+class QueryCache:
+    """Caches query results by key and counts hits and misses.
+
+    The backend's version is read before a miss is computed and the result is
+    only stored for that version, so an invalidate() that lands while the
+    query runs never leaves a pre-write result behind.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._stats_lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        """Returns the cached result for ``key``, running ``compute()`` on a miss."""
+        version = self.backend.version()
+        value = self.backend.get(key, version)
+        if value is not None:
+            with self._stats_lock:
+                self.hits += 1
+            return value
+        with self._stats_lock:
+            self.misses += 1
+        value = compute()
+        self.backend.set(key, value, version)
+        return value
+
+    def invalidate(self):
+        """Drops every cached result; call after any write to the underlying tables."""
+        with self._stats_lock:
+            self.invalidations += 1
+        self.backend.clear()
+
+    def stats(self):
+        with self._stats_lock:
+            hits, misses, invalidations = self.hits, self.misses, self.invalidations
+        lookups = hits + misses
+        return {
+            'backend': type(self.backend).__name__,
+            'entries': len(self.backend),
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / lookups if lookups else 0.0,
+            'invalidations': invalidations,
+        }
+
+
+def create_cache():
+    """Builds the cache configured by the VISIT_CACHE_* environment variables."""
+    ttl = int(os.getenv('VISIT_CACHE_TTL', 60))
+    redis_url = os.getenv('VISIT_CACHE_REDIS_URL')
+    if redis_url:
+        return QueryCache(RedisCache(redis_url, ttl=ttl))
+    return QueryCache(LRUCache(maxsize=int(os.getenv('VISIT_CACHE_SIZE', 256)), ttl=ttl))
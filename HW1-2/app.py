@@ -1,7 +1,8 @@
 import os
-from flask import Flask, render_template, request, redirect, url_for
-import mysql.connector
+from datetime import datetime
+from flask import Flask, render_template, stream_template, request, redirect, url_for, jsonify
 from dotenv import load_dotenv
+from db_pool import init_pool, get_db
 
 # Load environment variables from the .env file
 load_dotenv()
@@ -15,22 +16,88 @@ db_config = {
     "password": os.getenv("DB_PASSWORD"),
     "database": os.getenv("DB_NAME")
 }
+pool = init_pool(app, db_config)
 
 def get_db_connection():
-    """Create and return a database connection"""
-    conn = mysql.connector.connect(**db_config)
-    return conn
+    """Return this request's pooled database connection (returned to the pool on teardown)"""
+    return get_db()
 
-# Home page (Read): display all patient records
+# Number of records shown per page on the home page
+PAGE_SIZE = 30
+MAX_PAGE_SIZE = 200
+
+def encode_page_token(record):
+    """Build the ?after= token pointing just past the given record"""
+    return f"{record['created_at'].isoformat()}_{record['id']}"
+
+def decode_page_token(token):
+    """Parse an ?after= token back into a (created_at, id) keyset position"""
+    created_at, record_id = token.rsplit("_", 1)
+    return datetime.fromisoformat(created_at), int(record_id)
+
+class RecordPage:
+    """Lazily yields one page of records from an open cursor.
+
+    One extra row is fetched to learn whether a next page exists; once the
+    page has been iterated, next_token holds the ?after= value for it.
+    """
+    def __init__(self, cursor, page_size):
+        self.cursor = cursor
+        self.page_size = page_size
+        self.next_token = None
+
+    def __iter__(self):
+        last = None
+        try:
+            for count, record in enumerate(self.cursor):
+                if count == self.page_size:
+                    self.next_token = encode_page_token(last)
+                    break
+                last = record
+                yield record
+        finally:
+            # Also runs when the client disconnects mid-stream (GeneratorExit). The cursor
+            # is unbuffered: read what is left of the result set (at least the EOF packet
+            # after the extra row) or close() raises "Unread result found"
+            self.cursor.fetchall()
+            self.cursor.close()
+
+# Home page (Read): display patient records, newest first, one keyset page at a time
 @app.route("/")
 def index():
+    after = request.args.get("after")
+    page_size = min(request.args.get("limit", PAGE_SIZE, type=int), MAX_PAGE_SIZE)
+    if page_size < 1:
+        page_size = PAGE_SIZE
+
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM patient_records ORDER BY created_at DESC")
-    records = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    return render_template("index.html", records=records)
+    if after:
+        try:
+            created_at, record_id = decode_page_token(after)
+        except ValueError:
+            cursor.close()
+            return "Invalid page token", 400
+        # Seek past the last record of the previous page using idx_created_id
+        cursor.execute(
+            """
+            SELECT * FROM patient_records
+            WHERE created_at < %s OR (created_at = %s AND id < %s)
+            ORDER BY created_at DESC, id DESC
+            LIMIT %s
+            """,
+            (created_at, created_at, record_id, page_size + 1),
+        )
+    else:
+        cursor.execute(
+            "SELECT * FROM patient_records ORDER BY created_at DESC, id DESC LIMIT %s",
+            (page_size + 1,),
+        )
+
+    # Stream the rendered page (stream_template wraps it in stream_with_context),
+    # so the first bytes go out before every card is built
+    page = RecordPage(cursor, page_size)
+    return stream_template("index.html", records=page, page=page, after=after, page_size=page_size)
 
 # Add new record page (shows the form)
 @app.route("/add")
@@ -55,7 +122,6 @@ def create_record():
     cursor.execute(sql, (name, dob if dob else None, condition, notes))
     conn.commit()
     cursor.close()
-    conn.close()
     return redirect(url_for("index"))
 
 # Edit record page (shows the form with existing data)
@@ -66,7 +132,6 @@ def edit_form(record_id):
     cursor.execute("SELECT * FROM patient_records WHERE id = %s", (record_id,))
     record = cursor.fetchone()
     cursor.close()
-    conn.close()
     if record:
         return render_template("edit_record.html", record=record)
     return "Record not found", 404
@@ -89,7 +154,6 @@ def update_record(record_id):
     cursor.execute(sql, (name, dob if dob else None, condition, notes, record_id))
     conn.commit()
     cursor.close()
-    conn.close()
     return redirect(url_for("index"))
 
 # Handle the request to delete a record (Delete)
@@ -100,8 +164,12 @@ def delete_record(record_id):
     cursor.execute("DELETE FROM patient_records WHERE id = %s", (record_id,))
     conn.commit()
     cursor.close()
-    conn.close()
     return redirect(url_for("index"))
 
+# Connection pool metrics (wait time, in-use count, exhaustion events)
+@app.route("/pool-stats")
+def pool_stats():
+    return jsonify(pool.stats())
+
 if __name__ == "__main__":
     app.run(debug=True)
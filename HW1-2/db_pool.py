@@ -0,0 +1,179 @@
+# db_pool.py
+"""Pooled MySQL connections for the Flask app.
+
+A request borrows one connection the first time it calls ``get_db()`` and the
+connection goes back to the pool automatically when the app context tears
+down, so routes no longer pay a TCP + auth handshake per page view.
+"""
+import os
+import queue
+import threading
+import time
+
+import mysql.connector
+from mysql.connector.errors import PoolError
+from flask import current_app, g
+
+
+class ConnectionPool:
+    """A bounded, thread-safe pool of MySQL connections with usage metrics."""
+
+    def __init__(self, db_config, pool_size=5, timeout=10.0):
+        self.db_config = db_config
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        # Waiters on an exhausted pool sleep here until a connection is returned or a slot is freed
+        self._available = threading.Condition()
+        self._created = 0
+        self._in_use = 0
+        self._checkouts = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._exhausted = 0
+        self._timeouts = 0
+        self._reconnects = 0
+
+    def _connect(self):
+        return mysql.connector.connect(**self.db_config)
+
+    def _discard(self, conn):
+        """Drops a broken connection and frees its slot in the pool."""
+        self._close_quietly(conn)
+        self._free_slot()
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _free_slot(self):
+        with self._lock:
+            self._created -= 1
+        # A waiter can now open a new connection in this slot
+        with self._available:
+            self._available.notify()
+
+    def _reserve_slot(self):
+        with self._lock:
+            if self._created < self.pool_size:
+                self._created += 1
+                return True
+            return False
+
+    def _check_health(self, conn):
+        """Pings a connection on checkout and replaces it if the server dropped it."""
+        try:
+            conn.ping(reconnect=False)
+            return conn
+        except mysql.connector.Error:
+            # The replacement reuses the dead connection's slot, so it is only
+            # given up (and a waiter woken) if reconnecting fails
+            self._close_quietly(conn)
+        with self._lock:
+            self._reconnects += 1
+        try:
+            return self._connect()
+        except Exception:
+            self._free_slot()
+            raise
+
+    def _take(self):
+        """Takes an idle connection, or else reserves a slot for a new one: returns (conn, reserved)."""
+        try:
+            return self._idle.get_nowait(), False
+        except queue.Empty:
+            return None, self._reserve_slot()
+
+    def acquire(self):
+        """Borrows a connection, waiting up to ``timeout`` seconds if the pool is exhausted."""
+        start = time.perf_counter()
+        deadline = start + self.timeout
+        with self._available:
+            conn, reserved = self._take()
+            if conn is None and not reserved:
+                with self._lock:
+                    self._exhausted += 1
+            while conn is None and not reserved:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    with self._lock:
+                        self._timeouts += 1
+                    raise PoolError(f"No database connection available after {self.timeout}s (pool size {self.pool_size}).")
+                self._available.wait(remaining)
+                conn, reserved = self._take()
+
+        if reserved:
+            try:
+                conn = self._connect()
+            except Exception:
+                self._free_slot()
+                raise
+        else:
+            conn = self._check_health(conn)
+
+        waited = time.perf_counter() - start
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+            self._total_wait += waited
+            self._max_wait = max(self._max_wait, waited)
+        return conn
+
+    def release(self, conn):
+        """Returns a connection to the pool, rolling back anything left uncommitted."""
+        with self._lock:
+            self._in_use -= 1
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except mysql.connector.Error:
+            self._discard(conn)
+            return
+        with self._available:
+            self._idle.put(conn)
+            self._available.notify()
+
+    def stats(self):
+        """Returns a snapshot of the pool counters for sizing under real traffic."""
+        with self._lock:
+            return {
+                'pool_size': self.pool_size,
+                'open_connections': self._created,
+                'in_use': self._in_use,
+                'idle': self._idle.qsize(),
+                'checkouts': self._checkouts,
+                'avg_wait_ms': (self._total_wait / self._checkouts * 1000) if self._checkouts else 0.0,
+                'max_wait_ms': self._max_wait * 1000,
+                'exhaustion_events': self._exhausted,
+                'timeouts': self._timeouts,
+                'reconnects': self._reconnects,
+            }
+
+
+def init_pool(app, db_config):
+    """Creates the app's connection pool and returns borrowed connections on teardown."""
+    pool = ConnectionPool(
+        db_config,
+        pool_size=int(os.getenv('DB_POOL_SIZE', 5)),
+        timeout=float(os.getenv('DB_POOL_TIMEOUT', 10)),
+    )
+    app.extensions['db_pool'] = pool
+
+    @app.teardown_appcontext
+    def release_db(exception=None):
+        conn = g.pop('db_conn', None)
+        if conn is not None:
+            pool.release(conn)
+
+    return pool
+
+
+def get_db():
+    """Returns the connection bound to the current app context, borrowing one if needed."""
+    if 'db_conn' not in g:
+        g.db_conn = current_app.extensions['db_pool'].acquire()
+    return g.db_conn
@@ -1,9 +1,13 @@
 # app.py
 
-from flask import Flask, render_template, request, redirect, url_for, flash
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
 from dotenv import load_dotenv
 import os
 import mysql.connector
+from db_pool import init_pool, get_db
+from patient_loader import load_patient_detail
+from bulk_import import import_file, detect_format, CHUNK_SIZE
+import click
 
 # --- 1. Setup and Initialization ---
 load_dotenv()
@@ -13,23 +17,24 @@ if not app.secret_key:
     raise ValueError("ERROR: SECRET_KEY not found in environment variables. Please set it in your .env file.")
 
 # --- 2. Database Connection Function ---
+pool = init_pool(app, {
+    'host': os.environ.get('DB_HOST'),
+    'user': os.environ.get('DB_USER'),
+    'password': os.environ.get('DB_PASSWORD'),
+    'database': os.environ.get('DB_NAME')
+})
+
 def get_db_connection():
-    """Establishes and returns a MySQL database connection using credentials from environment variables."""
+    """Borrows this request's pooled MySQL connection; it is returned to the pool when the request ends."""
     try:
-        connection = mysql.connector.connect(
-            host=os.environ.get('DB_HOST'),
-            user=os.environ.get('DB_USER'),
-            password=os.environ.get('DB_PASSWORD'),
-            database=os.environ.get('DB_NAME')
-        )
-        return connection
+        return get_db()
     except mysql.connector.Error as err:
         print(f"Database connection error: {err}")
         return None
 
 # --- 3. Routes and View Functions (CRUD Logic) ---
 
-# Main Page: Display all patients (READ with JOIN)
+# Main Page: Display all patients with their stored condition_count (READ)
 @app.route('/')
 def index():
     conn = get_db_connection()
@@ -38,18 +43,10 @@ def index():
         return render_template('index.html', patients=[])
     
     cursor = conn.cursor(dictionary=True)
-    # SQL JOIN Query: Select all patients and count their number of conditions
-    query = """
-    SELECT p.*, COUNT(c.condition_id) as condition_count
-    FROM patients p
-    LEFT JOIN conditions c ON p.patient_id = c.patient_id
-    GROUP BY p.patient_id
-    ORDER BY p.name;
-    """
-    cursor.execute(query)
+    # condition_count is maintained on the patients row, so this is a single scan of idx_patients_name
+    cursor.execute('SELECT * FROM patients ORDER BY name')
     patients = cursor.fetchall()
     cursor.close()
-    conn.close()
     return render_template('index.html', patients=patients)
 
 # Add a new patient (CREATE)
@@ -64,7 +61,6 @@ def new_patient():
         )
         conn.commit()
         cursor.close()
-        conn.close()
         flash('Patient created successfully!', 'success')
         return redirect(url_for('index'))
     return render_template('patient_form.html', form_action='new_patient', patient=None)
@@ -81,14 +77,12 @@ def edit_patient(patient_id):
         )
         conn.commit()
         cursor.close()
-        conn.close()
         flash('Patient details updated successfully!', 'success')
         return redirect(url_for('index'))
     
     cursor.execute('SELECT * FROM patients WHERE patient_id = %s', (patient_id,))
     patient = cursor.fetchone()
     cursor.close()
-    conn.close()
     return render_template('patient_form.html', form_action='edit_patient', patient=patient)
 
 # Delete a patient (DELETE)
@@ -97,10 +91,10 @@ def delete_patient(patient_id):
     conn = get_db_connection()
     cursor = conn.cursor()
     # ON DELETE CASCADE will handle associated conditions and treatments
+    # (the patient's condition_count goes away with the patient row itself)
     cursor.execute('DELETE FROM patients WHERE patient_id = %s', (patient_id,))
     conn.commit()
     cursor.close()
-    conn.close()
     flash('Patient and all associated records deleted successfully.', 'danger')
     return redirect(url_for('index'))
 
@@ -108,27 +102,12 @@ def delete_patient(patient_id):
 @app.route('/patient/<int:patient_id>')
 def patient_detail(patient_id):
     conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    
-    cursor.execute('SELECT * FROM patients WHERE patient_id = %s', (patient_id,))
-    patient = cursor.fetchone()
-    
-    cursor.execute('SELECT * FROM conditions WHERE patient_id = %s ORDER BY diagnosis_date DESC', (patient_id,))
-    conditions = cursor.fetchall()
-    
-    query_treatments = """
-    SELECT t.*, c.condition_name 
-    FROM treatments t
-    JOIN conditions c ON t.condition_id = c.condition_id
-    WHERE c.patient_id = %s
-    ORDER BY t.start_date DESC
-    """
-    cursor.execute(query_treatments, (patient_id,))
-    treatments = cursor.fetchall()
-
-    cursor.close()
-    conn.close()
-    return render_template('patient_detail.html', patient=patient, conditions=conditions, treatments=treatments)
+    # One round trip: conditions and treatments come back as JSON arrays on the patient row
+    patient = load_patient_detail(conn, patient_id)
+    if patient is None:
+        flash('Patient not found.', 'danger')
+        return redirect(url_for('index'))
+    return render_template('patient_detail.html', patient=patient, conditions=patient['conditions'], treatments=patient['treatments'])
 
 # Add a condition for a patient (CREATE)
 @app.route('/patient/<int:patient_id>/condition/add', methods=['POST'])
@@ -139,9 +118,9 @@ def add_condition(patient_id):
         'INSERT INTO conditions (patient_id, condition_name, diagnosis_date, severity) VALUES (%s, %s, %s, %s)',
         (patient_id, request.form['condition_name'], request.form['diagnosis_date'], request.form['severity'])
     )
+    cursor.execute('UPDATE patients SET condition_count = condition_count + 1 WHERE patient_id = %s', (patient_id,))
     conn.commit()
     cursor.close()
-    conn.close()
     flash('Condition added successfully.', 'success')
     return redirect(url_for('patient_detail', patient_id=patient_id))
 
@@ -156,7 +135,6 @@ def add_treatment(patient_id):
     )
     conn.commit()
     cursor.close()
-    conn.close()
     flash('Treatment plan added successfully.', 'success')
     return redirect(url_for('patient_detail', patient_id=patient_id))
     
@@ -165,10 +143,14 @@ def add_treatment(patient_id):
 def delete_condition(patient_id, condition_id):
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('DELETE FROM conditions WHERE condition_id = %s', (condition_id,))
+    # Lock the condition row so its owner's condition_count is decremented exactly once
+    cursor.execute('SELECT patient_id FROM conditions WHERE condition_id = %s FOR UPDATE', (condition_id,))
+    row = cursor.fetchone()
+    if row:
+        cursor.execute('DELETE FROM conditions WHERE condition_id = %s', (condition_id,))
+        cursor.execute('UPDATE patients SET condition_count = condition_count - 1 WHERE patient_id = %s', (row[0],))
     conn.commit()
     cursor.close()
-    conn.close()
     flash('Condition deleted successfully.', 'danger')
     return redirect(url_for('patient_detail', patient_id=patient_id))
     
@@ -180,10 +162,62 @@ def delete_treatment(patient_id, treatment_id):
     cursor.execute('DELETE FROM treatments WHERE treatment_id = %s', (treatment_id,))
     conn.commit()
     cursor.close()
-    conn.close()
     flash('Treatment plan deleted successfully.', 'danger')
     return redirect(url_for('patient_detail', patient_id=patient_id))
 
+# Connection pool metrics for sizing DB_POOL_SIZE under real traffic
+@app.route('/pool-stats')
+def pool_stats():
+    return jsonify(pool.stats())
+
+# Recompute every patient's condition_count from the conditions table (one-shot repair/migration)
+@app.cli.command('rebuild-condition-counts')
+def rebuild_condition_counts():
+    """Rebuild the materialized patients.condition_count column."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+    UPDATE patients p
+    LEFT JOIN (SELECT patient_id, COUNT(*) AS n FROM conditions GROUP BY patient_id) c ON c.patient_id = p.patient_id
+    SET p.condition_count = COALESCE(c.n, 0)
+    """)
+    conn.commit()
+    print(f"Condition counts rebuilt ({cursor.rowcount} patients corrected).")
+    cursor.close()
+
+# Bulk import of patients, conditions and treatments from a CSV/NDJSON upload (CREATE in bulk)
+@app.route('/import', methods=['GET', 'POST'])
+def bulk_import():
+    if request.method == 'POST':
+        upload = request.files.get('import_file')
+        if not upload or not upload.filename:
+            flash('Please choose a CSV or NDJSON file to import.', 'danger')
+            return redirect(url_for('bulk_import'))
+        conn = get_db_connection()
+        if not conn:
+            flash('Database connection failed. Please check your .env configuration.', 'danger')
+            return redirect(url_for('bulk_import'))
+        stats = import_file(conn, upload.stream, detect_format(upload.filename))
+        if stats.failure:
+            flash(f'Could not read the whole file. {stats.summary()}', 'danger')
+        else:
+            flash(stats.summary(), 'success' if not stats.rejected else 'warning')
+        return render_template('import.html', stats=stats)
+    return render_template('import.html', stats=None)
+
+@app.cli.command('import-records')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']), help='Defaults to the file extension.')
+@click.option('--chunk-size', default=CHUNK_SIZE, show_default=True, help='Rows per batched insert and commit.')
+def import_records(path, fmt, chunk_size):
+    """Bulk-import patients, conditions and treatments from a CSV or NDJSON file."""
+    conn = get_db_connection()
+    with open(path, 'rb') as f:
+        stats = import_file(conn, f, fmt or detect_format(path), chunk_size)
+    print(stats.summary())
+    for error in stats.errors:
+        print(f"  {error}")
+
 # --- 4. Run the Application ---
 if __name__ == '__main__':
     # debug=True is useful for development. It should be set to False in production.
@@ -0,0 +1,95 @@
+# bench_patient_detail.py
+"""Benchmark: single-query vs. three-query patient detail loading.
+
+Seeds throwaway patients with N conditions and M treatments per condition into
+the database from .env, times both loaders on each, then deletes the patients
+again (ON DELETE CASCADE removes their conditions and treatments).
+
+Usage: python bench_patient_detail.py [--runs 200]
+"""
+import argparse
+import os
+import statistics
+import time
+
+import mysql.connector
+from dotenv import load_dotenv
+
+from patient_loader import load_patient_detail, load_patient_detail_multi
+
+# (conditions per patient, treatments per condition)
+SHAPES = [(0, 0), (1, 1), (5, 2), (20, 3), (100, 5)]
+
+
+def seed_patient(conn, n_conditions, n_treatments):
+    cursor = conn.cursor()
+    cursor.execute(
+        'INSERT INTO patients (name, birthdate, gender, contact_info, condition_count) VALUES (%s, %s, %s, %s, %s)',
+        (f'bench {n_conditions}x{n_treatments}', '1980-01-01', 'Other', 'benchmark', n_conditions)
+    )
+    patient_id = cursor.lastrowid
+    for i in range(n_conditions):
+        cursor.execute(
+            'INSERT INTO conditions (patient_id, condition_name, diagnosis_date, severity) VALUES (%s, %s, %s, %s)',
+            (patient_id, f'Condition {i}', f'2020-01-{i % 28 + 1:02d}', 'Mild')
+        )
+        condition_id = cursor.lastrowid
+        cursor.executemany(
+            'INSERT INTO treatments (condition_id, treatment_name, start_date, dosage) VALUES (%s, %s, %s, %s)',
+            [(condition_id, f'Treatment {j}', f'2021-02-{j % 28 + 1:02d}', '1 tablet') for j in range(n_treatments)]
+        )
+    conn.commit()
+    cursor.close()
+    return patient_id
+
+
+def time_loader(loader, conn, patient_id, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        loader(conn, patient_id)
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=200, help='loads per loader and shape')
+    args = parser.parse_args()
+
+    load_dotenv()
+    conn = mysql.connector.connect(
+        host=os.environ.get('DB_HOST'),
+        user=os.environ.get('DB_USER'),
+        password=os.environ.get('DB_PASSWORD'),
+        database=os.environ.get('DB_NAME')
+    )
+
+    patient_ids = []
+    try:
+        print(f"{'conditions':>10} {'treatments':>10} | {'3 queries p50/p95 (ms)':>24} | {'1 query p50/p95 (ms)':>22} | speedup")
+        for n_conditions, n_treatments in SHAPES:
+            patient_id = seed_patient(conn, n_conditions, n_treatments)
+            patient_ids.append(patient_id)
+
+            # Both loaders must agree before their timings mean anything
+            multi, single = load_patient_detail_multi(conn, patient_id), load_patient_detail(conn, patient_id)
+            assert len(multi['conditions']) == len(single['conditions'])
+            assert len(multi['treatments']) == len(single['treatments'])
+
+            multi_p50, multi_p95 = time_loader(load_patient_detail_multi, conn, patient_id, args.runs)
+            single_p50, single_p95 = time_loader(load_patient_detail, conn, patient_id, args.runs)
+            print(f"{n_conditions:>10} {n_conditions * n_treatments:>10} | "
+                  f"{multi_p50:>11.3f} / {multi_p95:<10.3f} | {single_p50:>10.3f} / {single_p95:<9.3f} | "
+                  f"{multi_p50 / single_p50:.2f}x")
+    finally:
+        cursor = conn.cursor()
+        cursor.executemany('DELETE FROM patients WHERE patient_id = %s', [(pid,) for pid in patient_ids])
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+# bulk_import.py
+"""Bulk import of patients, conditions and treatments from CSV or NDJSON.
+
+Every record carries a ``type`` column (patient, condition or treatment):
+
+    type       columns
+    patient    ref, name, birthdate, gender, contact_info
+    condition  ref, patient_ref or patient_id, condition_name, diagnosis_date, severity
+    treatment  condition_ref or condition_id, treatment_name, start_date, dosage
+
+``ref`` values are labels local to the import file that let children point at
+parents created by the same import; ``patient_id`` / ``condition_id`` attach
+records to rows that already exist in the database.
+
+The input is read incrementally and written in chunks: each chunk takes a
+short table lock, assigns primary keys up front (so parent ids resolve in
+memory instead of one lookup per row), inserts each table with a single
+batched executemany and commits before the next chunk is parsed.
+"""
+import csv
+import io
+import json
+import time
+from datetime import date
+
+import mysql.connector
+
+CHUNK_SIZE = 5000
+MAX_REPORTED_ERRORS = 50
+GENDERS = ('Male', 'Female', 'Other')
+
+
+class ImportStats:
+    """Counters reported at the end of an import."""
+
+    def __init__(self):
+        self.rows = 0
+        self.patients = 0
+        self.conditions = 0
+        self.treatments = 0
+        self.rejected = 0
+        self.errors = []
+        # Set when the file could not be read to the end; rows before that point stay imported
+        self.failure = None
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def reject(self, line_no, message):
+        self.rejected += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(f"Line {line_no}: {message}")
+
+    @property
+    def rows_per_sec(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def summary(self):
+        summary = (f"Imported {self.patients} patients, {self.conditions} conditions and {self.treatments} treatments "
+                   f"from {self.rows} rows in {self.elapsed:.1f}s ({self.rows_per_sec:,.0f} rows/sec, {self.rejected} rejected).")
+        if self.failure:
+            summary += f" Reading stopped after row {self.rows}: {self.failure}"
+        return summary
+
+
+def detect_format(filename):
+    return 'ndjson' if filename and filename.lower().endswith(('.ndjson', '.jsonl')) else 'csv'
+
+
+def iter_records(text_stream, fmt='csv'):
+    """Yields (line_no, record) pairs without reading the whole input; bad JSON yields None."""
+    if fmt == 'ndjson':
+        for line_no, line in enumerate(text_stream, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            yield line_no, record if isinstance(record, dict) else None
+    else:
+        reader = csv.DictReader(text_stream)
+        for record in reader:
+            yield reader.line_num, record
+
+
+def _text(record, field, required=True, max_length=100):
+    value = record.get(field)
+    value = str(value).strip() if value is not None else ''
+    if not value:
+        if required:
+            raise ValueError(f"missing {field}")
+        return None
+    if len(value) > max_length:
+        raise ValueError(f"{field} is longer than {max_length} characters")
+    return value
+
+
+def _date(record, field):
+    try:
+        return date.fromisoformat(_text(record, field))
+    except (TypeError, ValueError):
+        raise ValueError(f"{field} must be a YYYY-MM-DD date")
+
+
+def _int(record, field):
+    value = _text(record, field, required=False)
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        raise ValueError(f"{field} must be a number")
+
+
+def _id_column(rows, field):
+    """Collects the numeric ids a batch of records refers to."""
+    ids = set()
+    for _, record in rows:
+        value = str(record.get(field) or '').strip()
+        if value.isdigit():
+            ids.add(int(value))
+    return ids
+
+
+class BulkImporter:
+    """Streams records into medical_db in chunks; one instance per import."""
+
+    def __init__(self, conn, chunk_size=CHUNK_SIZE):
+        self.conn = conn
+        self.chunk_size = chunk_size
+        self.patient_refs = {}
+        self.condition_refs = {}
+        self.stats = ImportStats()
+
+    def run(self, records):
+        """Imports an iterable of (line_no, record) pairs and returns the ImportStats."""
+        chunk = []
+        try:
+            for line_no, record in records:
+                self.stats.rows += 1
+                chunk.append((line_no, record))
+                if len(chunk) >= self.chunk_size:
+                    self._flush(chunk)
+                    chunk = []
+        except (UnicodeDecodeError, csv.Error, ValueError) as e:
+            # Earlier chunks are already committed, so report them along with where reading stopped
+            self.stats.failure = str(e)
+        if chunk:
+            self._flush(chunk)
+        self.stats.elapsed = time.perf_counter() - self.stats.started
+        return self.stats
+
+    def _existing_ids(self, cursor, table, column, ids):
+        """Checks in one query which referenced ids already exist."""
+        if not ids:
+            return set()
+        placeholders = ', '.join(['%s'] * len(ids))
+        cursor.execute(f"SELECT {column} FROM {table} WHERE {column} IN ({placeholders})", list(ids))
+        return {row[0] for row in cursor.fetchall()}
+
+    def _flush(self, chunk):
+        rejected_before = self.stats.rejected
+        by_type = {'patient': [], 'condition': [], 'treatment': []}
+        for line_no, record in chunk:
+            kind = (record or {}).get('type', '')
+            if record is None:
+                self.stats.reject(line_no, "not a valid JSON object")
+            elif str(kind).strip().lower() not in by_type:
+                self.stats.reject(line_no, f"unknown type {kind!r}")
+            else:
+                by_type[str(kind).strip().lower()].append((line_no, record))
+        if not any(by_type.values()):
+            return
+
+        cursor = self.conn.cursor()
+        new_patient_refs, new_condition_refs = [], []
+        try:
+            # Hold the tables only while this chunk is written, so the web app keeps serving between chunks
+            cursor.execute("LOCK TABLES patients WRITE, conditions WRITE, treatments WRITE")
+            cursor.execute("SELECT COALESCE(MAX(patient_id), 0) FROM patients")
+            next_patient_id = cursor.fetchone()[0] + 1
+            cursor.execute("SELECT COALESCE(MAX(condition_id), 0) FROM conditions")
+            next_condition_id = cursor.fetchone()[0] + 1
+
+            known_patients = self._existing_ids(cursor, 'patients', 'patient_id', _id_column(by_type['condition'], 'patient_id'))
+            known_conditions = self._existing_ids(cursor, 'conditions', 'condition_id', _id_column(by_type['treatment'], 'condition_id'))
+
+            patient_rows = []
+            for line_no, record in by_type['patient']:
+                try:
+                    ref = _text(record, 'ref', required=False)
+                    gender = _text(record, 'gender')
+                    if gender not in GENDERS:
+                        raise ValueError(f"gender must be one of {', '.join(GENDERS)}")
+                    row = (next_patient_id, _text(record, 'name'), _date(record, 'birthdate'), gender,
+                           _text(record, 'contact_info', required=False))
+                except ValueError as e:
+                    self.stats.reject(line_no, e)
+                    continue
+                if ref is not None:
+                    self.patient_refs[ref] = next_patient_id
+                    new_patient_refs.append(ref)
+                patient_rows.append(row)
+                next_patient_id += 1
+
+            condition_rows, added_counts = [], {}
+            for line_no, record in by_type['condition']:
+                try:
+                    ref = _text(record, 'ref', required=False)
+                    patient_ref = _text(record, 'patient_ref', required=False)
+                    patient_id = self.patient_refs.get(patient_ref) if patient_ref else _int(record, 'patient_id')
+                    if patient_id is None or (not patient_ref and patient_id not in known_patients):
+                        raise ValueError("parent patient not found")
+                    row = (next_condition_id, patient_id, _text(record, 'condition_name'),
+                           _date(record, 'diagnosis_date'), _text(record, 'severity', required=False, max_length=50))
+                except ValueError as e:
+                    self.stats.reject(line_no, e)
+                    continue
+                if ref is not None:
+                    self.condition_refs[ref] = next_condition_id
+                    new_condition_refs.append(ref)
+                condition_rows.append(row)
+                added_counts[patient_id] = added_counts.get(patient_id, 0) + 1
+                next_condition_id += 1
+
+            treatment_rows = []
+            for line_no, record in by_type['treatment']:
+                try:
+                    condition_ref = _text(record, 'condition_ref', required=False)
+                    condition_id = self.condition_refs.get(condition_ref) if condition_ref else _int(record, 'condition_id')
+                    if condition_id is None or (not condition_ref and condition_id not in known_conditions):
+                        raise ValueError("parent condition not found")
+                    treatment_rows.append((condition_id, _text(record, 'treatment_name'), _date(record, 'start_date'),
+                                           _text(record, 'dosage', required=False)))
+                except ValueError as e:
+                    self.stats.reject(line_no, e)
+
+            if patient_rows:
+                cursor.executemany(
+                    "INSERT INTO patients (patient_id, name, birthdate, gender, contact_info) VALUES (%s, %s, %s, %s, %s)",
+                    patient_rows)
+            if condition_rows:
+                cursor.executemany(
+                    "INSERT INTO conditions (condition_id, patient_id, condition_name, diagnosis_date, severity) VALUES (%s, %s, %s, %s, %s)",
+                    condition_rows)
+                # Keep the materialized patients.condition_count in step with one UPDATE per chunk.
+                # patients is not aliased: under LOCK TABLES an alias must be locked by that name too
+                counts = " UNION ALL ".join(["SELECT %s AS patient_id, %s AS n"] * len(added_counts))
+                cursor.execute(
+                    f"UPDATE patients JOIN ({counts}) added ON patients.patient_id = added.patient_id "
+                    "SET patients.condition_count = patients.condition_count + added.n",
+                    [value for item in added_counts.items() for value in item])
+            if treatment_rows:
+                cursor.executemany(
+                    "INSERT INTO treatments (condition_id, treatment_name, start_date, dosage) VALUES (%s, %s, %s, %s)",
+                    treatment_rows)
+            self.conn.commit()
+        except mysql.connector.Error as err:
+            self.conn.rollback()
+            for ref in new_patient_refs:
+                self.patient_refs.pop(ref, None)
+            for ref in new_condition_refs:
+                self.condition_refs.pop(ref, None)
+            self.stats.rejected = rejected_before + len(chunk)
+            if len(self.stats.errors) < MAX_REPORTED_ERRORS:
+                self.stats.errors.append(f"Lines {chunk[0][0]}-{chunk[-1][0]} were not imported: {err}")
+            return
+        finally:
+            try:
+                cursor.execute("UNLOCK TABLES")
+            except mysql.connector.Error as err:
+                # Don't let this hide the error that got us here; the locks go with the connection anyway
+                print(f"UNLOCK TABLES failed: {err}")
+            cursor.close()
+
+        self.stats.patients += len(patient_rows)
+        self.stats.conditions += len(condition_rows)
+        self.stats.treatments += len(treatment_rows)
+
+
+def import_file(conn, binary_stream, fmt='csv', chunk_size=CHUNK_SIZE):
+    """Decodes a binary upload/file as UTF-8 on the fly and imports it."""
+    text_stream = io.TextIOWrapper(binary_stream, encoding='utf-8-sig', newline='')
+    return BulkImporter(conn, chunk_size).run(iter_records(text_stream, fmt))
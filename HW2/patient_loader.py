@@ -0,0 +1,78 @@
+# patient_loader.py
+"""Data loaders for the patient detail page.
+
+load_patient_detail() fetches the patient, its conditions and its treatments in
+a single round trip by aggregating the child rows into JSON arrays on the
+server (MySQL 5.7.22+). load_patient_detail_multi() is the original
+three-query path, kept for bench_patient_detail.py to compare against.
+"""
+import json
+from datetime import date
+
+PATIENT_DETAIL_QUERY = """
+SELECT p.patient_id, p.name, p.birthdate, p.gender, p.contact_info,
+    (SELECT JSON_ARRAYAGG(JSON_OBJECT(
+        'condition_id', c.condition_id,
+        'condition_name', c.condition_name,
+        'diagnosis_date', c.diagnosis_date,
+        'severity', c.severity))
+     FROM conditions c WHERE c.patient_id = p.patient_id) AS conditions,
+    (SELECT JSON_ARRAYAGG(JSON_OBJECT(
+        'treatment_id', t.treatment_id,
+        'condition_id', t.condition_id,
+        'condition_name', c.condition_name,
+        'treatment_name', t.treatment_name,
+        'start_date', t.start_date,
+        'dosage', t.dosage))
+     FROM treatments t JOIN conditions c ON t.condition_id = c.condition_id
+     WHERE c.patient_id = p.patient_id) AS treatments
+FROM patients p
+WHERE p.patient_id = %s
+"""
+
+
+def _json_rows(raw, date_field):
+    """Decodes a JSON_ARRAYAGG column, restoring dates and sorting newest first."""
+    rows = json.loads(raw) if raw else []
+    for row in rows:
+        row[date_field] = date.fromisoformat(row[date_field])
+    # JSON_ARRAYAGG ignores ORDER BY, so apply the page's newest-first order here
+    rows.sort(key=lambda r: r[date_field], reverse=True)
+    return rows
+
+
+def load_patient_detail(conn, patient_id):
+    """Returns the patient with nested 'conditions' and 'treatments' lists, or None."""
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute(PATIENT_DETAIL_QUERY, (patient_id,))
+    patient = cursor.fetchone()
+    cursor.close()
+    if patient is None:
+        return None
+    patient['conditions'] = _json_rows(patient['conditions'], 'diagnosis_date')
+    patient['treatments'] = _json_rows(patient['treatments'], 'start_date')
+    return patient
+
+
+def load_patient_detail_multi(conn, patient_id):
+    """The original three-query loader: patient, conditions, then treatments."""
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute('SELECT * FROM patients WHERE patient_id = %s', (patient_id,))
+    patient = cursor.fetchone()
+    if patient is None:
+        cursor.close()
+        return None
+
+    cursor.execute('SELECT * FROM conditions WHERE patient_id = %s ORDER BY diagnosis_date DESC', (patient_id,))
+    patient['conditions'] = cursor.fetchall()
+
+    cursor.execute("""
+    SELECT t.*, c.condition_name
+    FROM treatments t
+    JOIN conditions c ON t.condition_id = c.condition_id
+    WHERE c.patient_id = %s
+    ORDER BY t.start_date DESC
+    """, (patient_id,))
+    patient['treatments'] = cursor.fetchall()
+    cursor.close()
+    return patient
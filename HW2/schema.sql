@@ -10,7 +10,12 @@ CREATE TABLE patients (
     name VARCHAR(100) NOT NULL,
     birthdate DATE NOT NULL,
     gender ENUM('Male', 'Female', 'Other') NOT NULL,
-    contact_info VARCHAR(100)
+    contact_info VARCHAR(100),
+    -- Number of rows in conditions for this patient, maintained by the app
+    -- (add_condition / delete_condition) so the dashboard needs no JOIN + GROUP BY.
+    -- Rebuild with: flask --app app rebuild-condition-counts
+    condition_count INT NOT NULL DEFAULT 0,
+    INDEX idx_patients_name (name)
 );
 
 -- Table for Medical Conditions
@@ -44,7 +49,17 @@ INSERT INTO conditions (patient_id, condition_name, diagnosis_date, severity) VA
 (1, 'Type 2 Diabetes', '2023-03-15', 'Mild'),
 (2, 'Allergic Rhinitis', '2021-09-01', 'Mild');
 
+-- Bring the materialized condition counts in line with the sample conditions
+UPDATE patients p
+LEFT JOIN (SELECT patient_id, COUNT(*) AS n FROM conditions GROUP BY patient_id) c ON c.patient_id = p.patient_id
+SET p.condition_count = COALESCE(c.n, 0);
+
 INSERT INTO treatments (condition_id, treatment_name, start_date, dosage) VALUES
 (1, 'Lisinopril', '2022-01-11', '10mg daily'),
 (2, 'Metformin', '2023-03-16', '500mg after meals'),
-(3, 'Nasal Spray', '2021-09-01', 'Twice daily');
\ No newline at end of file
+(3, 'Nasal Spray', '2021-09-01', 'Twice daily');
+
+-- Upgrading an existing medical_db: add the column and index, then run the rebuild command
+-- ALTER TABLE patients
+--     ADD COLUMN condition_count INT NOT NULL DEFAULT 0,
+--     ADD INDEX idx_patients_name (name);
@@ -0,0 +1,87 @@
+# indexes.py
+"""Index management for stock_portfolio_db.
+
+ensure_indexes() is idempotent and runs at app startup; check_query_plans()
+explains the queries the routes and the price updater run and flags any that
+fall back to a COLLSCAN.
+
+Usage: python indexes.py [--check]
+"""
+import sys
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+INDEXES = {
+    'transactions': [
+        # recalculate_holding aggregates a user's trades in one symbol: $match on {user_id, symbol}
+        IndexModel([('user_id', ASCENDING), ('symbol', ASCENDING), ('date', DESCENDING)], name='user_symbol_date'),
+        # Transaction history sorts a user's trades by date; export and delete_all filter on user_id alone
+        IndexModel([('user_id', ASCENDING), ('date', DESCENDING)], name='user_date'),
+    ],
+    'holdings': [
+        IndexModel([('user_id', ASCENDING), ('symbol', ASCENDING)], name='user_symbol', unique=True),
+        # update_stock_prices runs distinct("symbol")
+        IndexModel([('symbol', ASCENDING)], name='symbol'),
+    ],
+    'prices': [
+        IndexModel([('symbol', ASCENDING)], name='symbol', unique=True),
+        # The dashboard looks up the most recent last_updated
+        IndexModel([('last_updated', DESCENDING)], name='last_updated'),
+    ],
+    'users': [
+        IndexModel([('username', ASCENDING)], name='username', unique=True),
+    ],
+}
+
+
+def ensure_indexes(db):
+    """Creates every index in INDEXES; existing ones are left untouched."""
+    for collection, models in INDEXES.items():
+        try:
+            db[collection].create_indexes(models)
+        except OperationFailure as e:
+            # e.g. duplicate usernames/symbols left over from before the unique index existed
+            print(f"Could not create indexes on {collection}: {e}", file=sys.stderr)
+
+
+def _route_queries(db, user_id):
+    """(description, explain output) for each hot query the app runs."""
+    yield 'index: holdings by user', db.holdings.find({'user_id': user_id}).sort('symbol', ASCENDING).explain()
+    yield 'index: prices by symbol', db.prices.find({'symbol': {'$in': ['AAPL', '2330.TW']}}).explain()
+    yield 'index: latest price update', db.prices.find().sort('last_updated', DESCENDING).limit(1).explain()
+    yield 'transactions: history', db.transactions.find({'user_id': user_id}).sort('date', DESCENDING).explain()
+    yield 'holdings: recalculate', db.command('aggregate', 'transactions', pipeline=[
+        {'$match': {'user_id': user_id, 'symbol': 'AAPL'}},
+        {'$group': {'_id': '$symbol', 'total_quantity': {'$sum': '$quantity'}}}
+    ], explain=True)
+    yield 'auth: user by username', db.users.find({'username': 'alice'}).explain()
+    yield 'prices: distinct held symbols', db.command('explain', {'distinct': 'holdings', 'key': 'symbol'})
+
+
+def _has_collscan(plan):
+    if isinstance(plan, dict):
+        if plan.get('stage') == 'COLLSCAN':
+            return True
+        return any(_has_collscan(v) for k, v in plan.items() if k != 'rejectedPlans')
+    if isinstance(plan, list):
+        return any(_has_collscan(v) for v in plan)
+    return False
+
+
+def check_query_plans(db):
+    """Returns the descriptions of route queries whose winning plan is a COLLSCAN."""
+    return [name for name, plan in _route_queries(db, ObjectId()) if _has_collscan(plan)]
+
+
+if __name__ == "__main__":
+    from extensions import db
+
+    ensure_indexes(db)
+    print("Indexes are up to date.")
+    if '--check' in sys.argv:
+        collscans = check_query_plans(db)
+        for name in collscans:
+            print(f"COLLSCAN: {name}")
+        print("No collection scans found." if not collscans else f"{len(collscans)} query(ies) need an index.")
+        sys.exit(1 if collscans else 0)
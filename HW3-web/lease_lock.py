@@ -0,0 +1,93 @@
+# lease_lock.py
+"""Mongo-backed lease lock shared by every worker and instance.
+
+A lock is one document in the `locks` collection, keyed by name:
+
+    {_id: name, owner, acquired_at, heartbeat, expires_at, finished_at}
+
+Acquiring is a single upsert that only matches when the lease has expired, so
+exactly one caller wins; the others hit the unique _id and get False back.
+While held, a heartbeat thread keeps pushing expires_at forward, so a worker
+that dies mid-refresh frees the lock within LEASE_TTL instead of holding it
+forever. Releasing records finished_at, which `cooldown` uses to skip work
+that another worker has just done.
+"""
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from pymongo.errors import DuplicateKeyError
+
+PRICE_REFRESH_LOCK = 'price_refresh'
+LEASE_TTL = timedelta(seconds=int(os.getenv("LEASE_TTL_SECONDS", 120)))
+
+
+class LeaseLock:
+    """Non-blocking lease on a named lock; use as `with LeaseLock(db.locks, name) as lock:`."""
+
+    def __init__(self, collection, name, ttl=LEASE_TTL, cooldown=None):
+        self.collection = collection
+        self.name = name
+        self.ttl = ttl
+        self.cooldown = cooldown
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.acquired = False
+        self.lost = False
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def acquire(self):
+        """Takes the lease if it is free (and outside the cooldown); returns whether it did."""
+        now = datetime.utcnow()
+        query = {'_id': self.name, 'expires_at': {'$lte': now}}
+        if self.cooldown is not None:
+            # $not/$gt also matches documents that have never finished a run
+            query['finished_at'] = {'$not': {'$gt': now - self.cooldown}}
+        try:
+            self.collection.update_one(
+                query,
+                {'$set': {'owner': self.owner, 'acquired_at': now, 'heartbeat': now, 'expires_at': now + self.ttl}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # The document exists but did not match: someone else holds the lease
+            return False
+
+        self.acquired = True
+        self._heartbeat = threading.Thread(target=self._beat, name=f"lease-{self.name}", daemon=True)
+        self._heartbeat.start()
+        return True
+
+    def _beat(self):
+        while not self._stop.wait(self.ttl.total_seconds() / 3):
+            now = datetime.utcnow()
+            result = self.collection.update_one(
+                {'_id': self.name, 'owner': self.owner},
+                {'$set': {'heartbeat': now, 'expires_at': now + self.ttl}}
+            )
+            if result.matched_count == 0:
+                # Our lease expired and another worker took over; the caller can check `lost`
+                print(f"Lease '{self.name}' was lost by {self.owner}")
+                self.lost = True
+                return
+
+    def release(self):
+        if not self.acquired:
+            return
+        self._stop.set()
+        self._heartbeat.join()
+        now = datetime.utcnow()
+        self.collection.update_one(
+            {'_id': self.name, 'owner': self.owner},
+            {'$set': {'owner': None, 'expires_at': now, 'finished_at': now}}
+        )
+        self.acquired = False
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
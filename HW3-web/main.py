@@ -8,6 +8,7 @@ import csv
 from extensions import db
 from pymongo import DESCENDING
 from update_prices import update_stock_prices
+from lease_lock import LeaseLock, PRICE_REFRESH_LOCK
 
 bp = Blueprint('main', __name__)
 
@@ -74,14 +75,18 @@ def refresh_prices_route():
             flash("You can only refresh prices once every 5 minutes.", "warning")
             return redirect(url_for('main.index'))
 
-    try:
-        print("--- [Manual Trigger] Running Price Update ---")
-        update_stock_prices()
-        session['last_refresh'] = datetime.utcnow().isoformat()
-        flash("Price data has been updated successfully!", "success")
-    except Exception as e:
-        flash(f"An error occurred during the update: {e}", "danger")
-        print(f"Manual refresh failed: {e}")
+    with LeaseLock(db.locks, PRICE_REFRESH_LOCK) as lock:
+        if not lock.acquired:
+            flash("Prices are already being refreshed. Please check back in a moment.", "info")
+            return redirect(url_for('main.index'))
+        try:
+            print("--- [Manual Trigger] Running Price Update ---")
+            update_stock_prices()
+            session['last_refresh'] = datetime.utcnow().isoformat()
+            flash("Price data has been updated successfully!", "success")
+        except Exception as e:
+            flash(f"An error occurred during the update: {e}", "danger")
+            print(f"Manual refresh failed: {e}")
 
     return redirect(url_for('main.index'))
 
@@ -1,17 +1,31 @@
 # update_prices.py
+# 單次更新：python update_prices.py
+# 常駐更新程序（部署為獨立的 Background Worker）：python update_prices.py --daemon
 import yfinance as yf
 import requests
 from pymongo import MongoClient, UpdateOne
 from dotenv import load_dotenv
+import argparse
+import json
 import os
+import signal
+import threading
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
 import pandas as pd
+from lease_lock import LeaseLock, PRICE_REFRESH_LOCK
 
 load_dotenv()
 MONGO_URI = os.getenv("MONGO_URI")
 FINNHUB_API_KEY = os.getenv("FINNHUB_API_KEY")
 
+# 常駐模式下兩次更新之間的間隔（分鐘）
+PRICE_UPDATE_INTERVAL = timedelta(minutes=float(os.getenv("PRICE_UPDATE_INTERVAL_MINUTES", 60)))
+# 若其他進程（例如手動更新）在此時間內已完成更新，這次排程更新就跳過
+SCHEDULED_REFRESH_COOLDOWN = PRICE_UPDATE_INTERVAL * 5 / 6
+# 更新失敗後多久重試
+RETRY_AFTER = timedelta(minutes=1)
+
 try:
     client = MongoClient(MONGO_URI)
     db = client.stock_portfolio_db
@@ -122,6 +136,54 @@ def update_stock_prices():
         print(f"Preparing to bulk update {len(update_operations)} price records...")
         result = prices_collection.bulk_write(update_operations)
         print(f"Bulk update complete. Matched: {result.matched_count}, Upserted: {result.upserted_count}")
+    return len(update_operations)
+
+def run_scheduled_update():
+    """在租約鎖保護下執行一次排程更新，並以一行 JSON 輸出這次執行的指標；回傳狀態。"""
+    metrics = {'event': 'price_update', 'started_at': datetime.utcnow().isoformat()}
+    started = time.perf_counter()
+    try:
+        with LeaseLock(db.locks, PRICE_REFRESH_LOCK, cooldown=SCHEDULED_REFRESH_COOLDOWN) as lock:
+            if not lock.acquired:
+                metrics['status'] = 'skipped'
+            else:
+                metrics['updated'] = update_stock_prices() or 0
+                metrics['status'] = 'succeeded'
+    except Exception as e:
+        metrics.update({'status': 'failed', 'error': str(e)})
+    metrics['duration_s'] = round(time.perf_counter() - started, 3)
+    print(json.dumps(metrics), flush=True)
+    return metrics['status']
+
+def run_daemon():
+    """常駐執行，每 PRICE_UPDATE_INTERVAL 更新一次，收到 SIGTERM/SIGINT 後在目前的更新結束時停止。"""
+    if db is None:
+        print("No database connection. Price daemon not started.")
+        return
+
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        print(f"--- [Price daemon] {signal.Signals(signum).name} received, stopping after the current run ---", flush=True)
+        stop.set()
+        # 再收到一次訊號就立即結束
+        signal.signal(signum, signal.SIG_DFL)
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    print(f"--- [Price daemon] Started (PID {os.getpid()}), updating every {PRICE_UPDATE_INTERVAL} ---", flush=True)
+    while not stop.is_set():
+        status = run_scheduled_update()
+        wait = RETRY_AFTER if status == 'failed' else PRICE_UPDATE_INTERVAL
+        stop.wait(wait.total_seconds())
+    print("--- [Price daemon] Stopped ---", flush=True)
 
 if __name__ == "__main__":
-    update_stock_prices()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Refresh stock prices once, or keep refreshing them with --daemon.")
+    parser.add_argument('--daemon', action='store_true', help='run the long-running price updater')
+    args = parser.parse_args()
+    if args.daemon:
+        run_daemon()
+    else:
+        update_stock_prices()
\ No newline at end of file
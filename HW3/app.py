@@ -3,9 +3,15 @@ from flask import Flask
 import os
 from extensions import db, login_manager
 from models import load_user
+from indexes import ensure_indexes
 from apscheduler.schedulers.background import BackgroundScheduler
+from datetime import timedelta
+from lease_lock import LeaseLock, PRICE_REFRESH_LOCK
 from update_prices import update_stock_prices
 
+# Scheduled runs skip when any worker (or a manual refresh) finished a refresh more recently than this
+SCHEDULED_REFRESH_COOLDOWN = timedelta(minutes=50)
+
 def create_app():
     """Application Factory"""
     app = Flask(__name__)
@@ -14,6 +20,9 @@ def create_app():
     # Initialize extensions
     login_manager.init_app(app)
 
+    # Create any missing indexes (idempotent)
+    ensure_indexes(db)
+
     @login_manager.user_loader
     def user_loader(user_id):
         return load_user(user_id)
@@ -30,8 +39,15 @@ def create_app():
 app = create_app()
 
 def scheduled_update():
-    """Wrapper function to run the update within the app context."""
-    with app.app_context():
+    """Wrapper function to run the update within the app context.
+
+    Every process that runs the scheduler calls this; the lease lock lets only
+    one of them refresh at a time, and the cooldown skips the others' runs.
+    """
+    with app.app_context(), LeaseLock(db.locks, PRICE_REFRESH_LOCK, cooldown=SCHEDULED_REFRESH_COOLDOWN) as lock:
+        if not lock.acquired:
+            print("--- [Scheduler] Skipped: prices are being or were just refreshed elsewhere ---")
+            return
         print("--- [Scheduler] Running Scheduled Price Update ---")
         update_stock_prices()
         print("--- [Scheduler] Scheduled Price Update Finished ---")
@@ -39,8 +55,7 @@ def scheduled_update():
 if __name__ == '__main__':
     # Run the update once on startup to ensure data is fresh
     print("--- [Startup] Running initial price update... ---")
-    with app.app_context():
-        update_stock_prices()
+    scheduled_update()
     print("--- [Startup] Initial price update finished. ---")
 
     # Then schedule it to run periodically
@@ -1,10 +1,10 @@
 # app.py
 from flask import Flask
 import os
+import threading
 from extensions import db, login_manager, csrf
 from models import load_user
-from apscheduler.schedulers.background import BackgroundScheduler
-from update_prices import update_stock_prices
+from indexes import ensure_indexes
 
 def create_app():
     """Application Factory"""
@@ -15,6 +15,20 @@ def create_app():
     login_manager.init_app(app)
     csrf.init_app(app)
 
+    # Create any missing indexes (idempotent) on the first request each process
+    # serves, so booting a worker doesn't wait on MongoDB
+    indexes_checked = threading.Event()
+    indexes_lock = threading.Lock()
+
+    @app.before_request
+    def ensure_indexes_once():
+        if indexes_checked.is_set():
+            return
+        with indexes_lock:
+            if not indexes_checked.is_set():
+                ensure_indexes(db)
+                indexes_checked.set()
+
     @login_manager.user_loader
     def user_loader(user_id):
         return load_user(user_id)
@@ -30,26 +44,7 @@ def create_app():
 
 app = create_app()
 
-def scheduled_update():
-    """Wrapper function to run the update within the app context."""
-    with app.app_context():
-        print("--- [Scheduler] Running Scheduled Price Update ---")
-        update_stock_prices()
-        print("--- [Scheduler] Scheduled Price Update Finished ---")
-
 if __name__ == '__main__':
-    # Run the update once on startup to ensure data is fresh
-    print("--- [Startup] Running initial price update... ---")
-    with app.app_context():
-        update_stock_prices()
-    print("--- [Startup] Initial price update finished. ---")
-
-    # Then schedule it to run periodically
-    scheduler = BackgroundScheduler(daemon=True)
-    scheduler.add_job(scheduled_update, 'interval', hours=1)
-    scheduler.start()
-    
-    print("Scheduler started. Prices will be updated every hour.")
-    
-    # use_reloader=False is important to prevent the scheduler from running twice in debug mode
-    app.run(debug=True, use_reloader=False)
+    # Prices are refreshed by the price daemon, which runs as its own process
+    print("Scheduler is NOT started here; run `python update_prices.py --daemon` to keep prices updated.")
+    app.run(debug=True)
@@ -2,7 +2,7 @@
 from flask import Blueprint, render_template, request, flash, redirect, url_for
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import login_user, logout_user, login_required, current_user
-from models import User
+from models import User, invalidate_user
 from extensions import db
 
 bp = Blueprint('auth', __name__, url_prefix='/auth')
@@ -61,6 +61,7 @@ def login():
 @bp.route('/logout')
 @login_required
 def logout():
+    invalidate_user(current_user.id)
     logout_user()
     flash('You have been logged out.', 'info')
     return redirect(url_for('auth.login'))
@@ -0,0 +1,28 @@
+# background.py
+"""Thread pools for work that outlives the request that started it."""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class LazyExecutor:
+    """A ThreadPoolExecutor that is only created on the first submit().
+
+    Nothing is started at import time, so gunicorn workers don't inherit a
+    pool (and its dead threads) from the master; a process forked after the
+    pool exists gets a fresh one, as extensions.get_client does for MongoClient.
+    """
+    def __init__(self, max_workers, thread_name_prefix):
+        self.max_workers = max_workers
+        self.thread_name_prefix = thread_name_prefix
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.thread_name_prefix)
+                self._pid = os.getpid()
+            executor = self._executor
+        return executor.submit(fn, *args, **kwargs)
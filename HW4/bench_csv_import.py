@@ -0,0 +1,84 @@
+# bench_csv_import.py
+"""Benchmark: streaming CSV import throughput at 10k/100k/1M rows.
+
+Writes a deterministic CSV (with ~1% invalid rows) per size to a temp file,
+imports it for a throwaway user into a stock_portfolio_bench database on
+MONGO_URI with import_transactions, and reports rows/sec and rejected rows.
+With --memory the import is repeated under tracemalloc to report the peak
+Python allocation, which should stay flat as the file grows. The bench
+database is dropped at the end.
+
+Usage: python bench_csv_import.py [--sizes 10000 100000 1000000] [--chunk-size 5000] [--memory]
+"""
+import argparse
+import os
+import random
+import tempfile
+import tracemalloc
+
+from bson.objectid import ObjectId
+from dotenv import load_dotenv
+from pymongo import MongoClient
+
+from csv_import import IMPORT_CHUNK_SIZE, import_transactions
+
+SIZES = [10000, 100000, 1000000]
+BENCH_DB = 'stock_portfolio_bench'
+SYMBOLS = ['AAPL', 'MSFT', 'NVDA', 'TSLA', '2330.TW', '0050.TW', 'GOOG', 'AMZN']
+
+
+def write_csv(path, n_rows, seed=42):
+    rng = random.Random(seed)
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        f.write('Symbol,Quantity,Price\n')
+        for _ in range(n_rows):
+            if rng.random() < 0.01:
+                f.write(f"{rng.choice(SYMBOLS)},not-a-number,1\n")
+            else:
+                f.write(f"{rng.choice(SYMBOLS)},{rng.randint(1, 500)},{rng.uniform(5, 900):.2f}\n")
+
+
+def run_import(db, path, chunk_size):
+    user_id = ObjectId()
+    with open(path, 'rb') as f:
+        stats = import_transactions(db, user_id, f, chunk_size)
+    db.transactions.delete_many({'user_id': user_id})
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='rows per CSV file')
+    parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE, help='rows per insert_many')
+    parser.add_argument('--memory', action='store_true', help='also report peak Python memory (slower)')
+    args = parser.parse_args()
+
+    load_dotenv()
+    client = MongoClient(os.getenv("MONGO_URI"))
+    db = client[BENCH_DB]
+    workdir = tempfile.mkdtemp()
+    path = os.path.join(workdir, 'import.csv')
+    try:
+        print(f"{'rows':>9} | {'file (MB)':>9} | {'seconds':>8} | {'rows/sec':>10} | {'rejected':>8}" + (" | peak mem (MB)" if args.memory else ""))
+        for n_rows in args.sizes:
+            write_csv(path, n_rows)
+            stats = run_import(db, path, args.chunk_size)
+            assert stats.imported + stats.rejected == n_rows
+            line = (f"{n_rows:>9} | {os.path.getsize(path) / 1e6:>9.1f} | {stats.elapsed:>8.2f} | "
+                    f"{stats.rows_per_sec:>10,.0f} | {stats.rejected:>8}")
+            if args.memory:
+                tracemalloc.start()
+                run_import(db, path, args.chunk_size)
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                line += f" | {peak / 1e6:>14.1f}"
+            print(line)
+    finally:
+        client.drop_database(BENCH_DB)
+        if os.path.exists(path):
+            os.remove(path)
+        os.rmdir(workdir)
+
+
+if __name__ == '__main__':
+    main()
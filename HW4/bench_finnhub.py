@@ -0,0 +1,183 @@
+# bench_finnhub.py
+"""Benchmark: FinnhubProvider against a local stub of the Finnhub quote API.
+
+Starts an http.server stub on localhost, points FINNHUB_BASE_URL at it and
+fetches a universe of symbols through FinnhubProvider. The stub answers every
+Nth call with 429 and a Retry-After header, always throttles the symbol
+THROTTLED, answers NO_PC without a previous close and first answers LONG_WAIT
+with an hour-long Retry-After. The run checks that:
+
+- no window of calls exceeded the token bucket (burst + rate * window), and the
+  achieved rate after the burst stays close to FINNHUB_CALLS_PER_MINUTE;
+- every 429 was retried, no sooner than half its Retry-After (the backoff jitter);
+- LONG_WAIT's sleep is capped at FINNHUB_MAX_BACKOFF and it still gets a quote;
+- THROTTLED gives up after FINNHUB_MAX_RETRIES retries, and it and NO_PC are
+  the only errors, without losing the rest of the batch.
+
+No network access or API key is needed.
+
+Usage: python bench_finnhub.py [--symbols 120] [--rate 600] [--burst 10] [--throttle-every 15] [--retry-after 1]
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+THROTTLED = 'THROTTLED'
+NO_PC = 'NO_PC'
+LONG_WAIT = 'LONG_WAIT'
+# Retry-After sent on LONG_WAIT's first call, and the cap the run sets
+LONG_RETRY_AFTER = 3600
+MAX_BACKOFF = 1
+# Slack for clock granularity when comparing request timestamps to the bucket
+TIMING_SLACK = 0.02
+
+
+class StubFinnhub(ThreadingHTTPServer):
+    """Quote API stub that records when each symbol was requested and what it answered."""
+    daemon_threads = True
+
+    def __init__(self, throttle_every, retry_after):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.throttle_every = throttle_every
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.calls = []  # (monotonic time, symbol, status)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        symbol = parse_qs(url.query).get('symbol', [''])[0]
+        server = self.server
+        with server.lock:
+            n = len(server.calls) + 1
+            long_wait = symbol == LONG_WAIT and not any(s == LONG_WAIT for _, s, _ in server.calls)
+            throttled = long_wait or symbol == THROTTLED or n % server.throttle_every == 0
+            status = 429 if throttled else 200
+            server.calls.append((time.monotonic(), symbol, status))
+
+        if throttled:
+            self.send_response(429)
+            self.send_header('Retry-After', str(LONG_RETRY_AFTER if long_wait else server.retry_after))
+            body = b'{"error": "API limit reached"}'
+        else:
+            self.send_response(200)
+            quote = {'c': 100.0 + n} if symbol == NO_PC else {'c': 100.0 + n, 'pc': 99.0}
+            body = json.dumps(quote).encode()
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def check_rate(times, rate, burst):
+    """Returns (max excess over the bucket in any window, achieved calls/s after the burst)."""
+    worst = 0.0
+    for i in range(len(times)):
+        for j in range(i, len(times)):
+            allowed = burst + rate * (times[j] - times[i]) + rate * TIMING_SLACK
+            worst = max(worst, (j - i + 1) - allowed)
+    after_burst = times[burst:]
+    achieved = (len(after_burst) - 1) / (after_burst[-1] - after_burst[0]) if len(after_burst) > 1 else 0.0
+    return worst, achieved
+
+
+def check_retries(calls, retry_after):
+    """Returns (throttled calls, retried throttled calls, shortest gap before a retry), LONG_WAIT aside."""
+    by_symbol = {}
+    for at, symbol, status in calls:
+        if symbol != LONG_WAIT:
+            by_symbol.setdefault(symbol, []).append((at, status))
+    throttled = retried = 0
+    shortest = None
+    for symbol, attempts in by_symbol.items():
+        for (at, status), following in zip(attempts, attempts[1:] + [None]):
+            if status != 429:
+                continue
+            throttled += 1
+            if following:
+                retried += 1
+                gap = following[0] - at
+                shortest = gap if shortest is None else min(shortest, gap)
+    return throttled, retried, shortest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--symbols', type=int, default=120, help='symbols to fetch (plus THROTTLED, NO_PC and LONG_WAIT)')
+    parser.add_argument('--rate', type=int, default=600, help='FINNHUB_CALLS_PER_MINUTE for the run')
+    parser.add_argument('--burst', type=int, default=10, help='FINNHUB_BURST for the run')
+    parser.add_argument('--throttle-every', type=int, default=15, help='the stub answers every Nth call with 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds sent with each 429')
+    args = parser.parse_args()
+
+    server = StubFinnhub(args.throttle_every, args.retry_after)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # price_providers reads its settings at import time
+    os.environ.update({
+        'FINNHUB_BASE_URL': f"http://127.0.0.1:{server.server_port}",
+        'FINNHUB_API_KEY': 'stub',
+        'FINNHUB_CALLS_PER_MINUTE': str(args.rate),
+        'FINNHUB_BURST': str(args.burst),
+        'FINNHUB_MAX_BACKOFF': str(MAX_BACKOFF),
+    })
+    import requests
+    from price_providers import FINNHUB_MAX_RETRIES, FinnhubProvider
+
+    symbols = [f"SYM{i:04d}" for i in range(args.symbols)] + [THROTTLED, NO_PC, LONG_WAIT]
+    provider = FinnhubProvider(requests.Session())
+    started = time.perf_counter()
+    quotes = provider.fetch_quotes(symbols)
+    elapsed = time.perf_counter() - started
+    server.shutdown()
+
+    rate = args.rate / 60
+    worst, achieved = check_rate([at for at, _, _ in server.calls], rate, args.burst)
+    throttled, retried, shortest = check_retries(server.calls, args.retry_after)
+    throttled_attempts = sum(1 for _, symbol, _ in server.calls if symbol == THROTTLED)
+    long_wait_calls = [at for at, symbol, _ in server.calls if symbol == LONG_WAIT]
+    long_wait_gap = long_wait_calls[1] - long_wait_calls[0] if len(long_wait_calls) > 1 else None
+    stats = provider.stats()
+
+    print(f"{len(server.calls)} calls for {len(symbols)} symbols in {elapsed:.2f}s")
+    print(f"rate: limit {rate:.1f}/s, achieved {achieved:.1f}/s after a burst of {args.burst}, "
+          f"worst window {worst:+.2f} calls over the bucket")
+    print(f"429s: {throttled}, retried {retried}, shortest retry gap "
+          f"{shortest:.2f}s (Retry-After {args.retry_after}s)" if shortest is not None else f"429s: {throttled}")
+    print(f"provider: {stats['quotes_returned']}/{stats['symbols_requested']} quotes, {stats['errors']} errors")
+
+    failures = []
+    if worst > 0:
+        failures.append("calls exceeded the token bucket")
+    if achieved > rate * 1.05 or achieved < rate * 0.5:
+        failures.append(f"achieved rate {achieved:.1f}/s is off the {rate:.1f}/s limit")
+    if set(quotes) != set(symbols) - {THROTTLED, NO_PC}:
+        failures.append(f"{len(set(symbols) - {THROTTLED, NO_PC} - set(quotes))} symbols got no quote despite retries")
+    if long_wait_gap is None or long_wait_gap > MAX_BACKOFF + 1:
+        failures.append(f"{LONG_WAIT} was not retried within the {MAX_BACKOFF}s backoff cap")
+    if throttled_attempts != FINNHUB_MAX_RETRIES + 1:
+        failures.append(f"{THROTTLED} was tried {throttled_attempts} times, expected {FINNHUB_MAX_RETRIES + 1}")
+    if retried != throttled - 1:
+        # Every 429 is retried except the last attempt for THROTTLED
+        failures.append(f"only {retried} of {throttled} throttled calls were retried")
+    if shortest is not None and shortest < args.retry_after * 0.5 - TIMING_SLACK:
+        failures.append(f"a retry came {shortest:.2f}s after a 429, before half its Retry-After")
+    if stats['errors'] != 2:
+        failures.append(f"{stats['errors']} errors counted, expected 2 ({THROTTLED}, {NO_PC})")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
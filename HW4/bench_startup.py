@@ -0,0 +1,90 @@
+# bench_startup.py
+"""Benchmark: web worker boot time and memory.
+
+Imports app.py (which builds the Flask app, as a gunicorn worker does) in
+fresh interpreters and reports the median import time, resident memory after
+the import, and whether the price-fetching stack (yfinance, pandas) was
+loaded. With --rev, the same is measured for HW4 at another git revision
+(e.g. the commit before the lazy MongoClient) so the two can be compared.
+Needs the .env of this directory; older revisions also connect to MONGO_URI
+while importing.
+
+Usage: python bench_startup.py [--runs 5] [--rev HEAD~1]
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+HEAVY_MODULES = ['yfinance', 'pandas', 'requests', 'apscheduler']
+
+# Runs in the child interpreter, from the directory being measured
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import app
+elapsed = time.perf_counter() - started
+rss_kb = 0
+try:
+    with open('/proc/self/status') as f:
+        rss_kb = next(int(line.split()[1]) for line in f if line.startswith('VmRSS:'))
+except OSError:
+    import resource
+    rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({'seconds': elapsed, 'rss_mb': rss_kb / 1024,
+                  'loaded': [m for m in %r if m in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+
+def measure(directory, runs):
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', PROBE], cwd=directory, capture_output=True, text=True)
+        if out.returncode:
+            sys.exit(f"Importing app in {directory} failed:\n{out.stderr.strip()[-2000:]}")
+        samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return {
+        'seconds': statistics.median(s['seconds'] for s in samples),
+        'rss_mb': statistics.median(s['rss_mb'] for s in samples),
+        'loaded': samples[-1]['loaded'],
+    }
+
+
+def checkout(rev, workdir):
+    """Extracts HW4 at `rev` into workdir and returns its path."""
+    repo_root = subprocess.run(['git', 'rev-parse', '--show-toplevel'], cwd=HERE, capture_output=True, text=True, check=True).stdout.strip()
+    prefix = os.path.relpath(HERE, repo_root)
+    archive = subprocess.run(['git', 'archive', rev, prefix], cwd=repo_root, capture_output=True, check=True).stdout
+    subprocess.run(['tar', '-x', '-C', workdir], input=archive, check=True)
+    target = os.path.join(workdir, prefix)
+    if os.path.exists(os.path.join(HERE, '.env')):
+        shutil.copy(os.path.join(HERE, '.env'), target)
+    return target
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters per tree')
+    parser.add_argument('--rev', help='also measure HW4 at this git revision')
+    args = parser.parse_args()
+
+    results = [('working tree', measure(HERE, args.runs))]
+    if args.rev:
+        workdir = tempfile.mkdtemp()
+        try:
+            results.insert(0, (args.rev, measure(checkout(args.rev, workdir), args.runs)))
+        finally:
+            shutil.rmtree(workdir)
+
+    print(f"{'tree':>14} | {'import app (s)':>14} | {'RSS (MB)':>8} | heavy modules loaded")
+    for name, result in results:
+        print(f"{name:>14} | {result['seconds']:>14.3f} | {result['rss_mb']:>8.1f} | {', '.join(result['loaded']) or '-'}")
+
+
+if __name__ == '__main__':
+    main()
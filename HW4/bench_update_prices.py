@@ -0,0 +1,127 @@
+# bench_update_prices.py
+"""Benchmark: end-to-end update_stock_prices throughput, offline.
+
+For each universe size, generates deterministic quotes into a replay file,
+seeds one holding per symbol into a throwaway stock_portfolio_bench database
+on MONGO_URI, and times update_stock_prices with a ReplayProvider. Every run
+refetches the whole universe (force=True, bypassing the staleness planner);
+the first run of each size writes names too (cold name cache).
+The bench database is dropped at the end.
+
+Usage: python bench_update_prices.py [--sizes 10 100 1000 10000] [--runs 3]
+                                     [--save results.json] [--baseline results.json]
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from bson.objectid import ObjectId
+from pymongo import MongoClient
+
+from price_providers import ReplayProvider
+from extensions import MONGO_URI
+from update_prices import update_stock_prices
+
+SIZES = [10, 100, 1000, 10000]
+BENCH_DB = 'stock_portfolio_bench'
+# A size counts as a regression when its throughput drops by more than this fraction of the baseline
+REGRESSION_TOLERANCE = 0.2
+
+
+def write_replay_file(path, n_symbols, seed=42):
+    """Seeded quotes, so every run and every machine replays the same data."""
+    rng = random.Random(seed)
+    recorded = {}
+    for i in range(n_symbols):
+        previous_close = round(rng.uniform(5, 500), 2)
+        recorded[f'SYM{i:05d}'] = {
+            'current_price': round(previous_close * rng.uniform(0.95, 1.05), 2),
+            'previous_close': previous_close,
+            'name': f'Benchmark Company {i}',
+        }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(recorded, f)
+    return list(recorded)
+
+
+def seed_holdings(db, symbols):
+    db.prices.delete_many({})
+    db.holdings.delete_many({})
+    user_id = ObjectId()
+    db.holdings.insert_many([
+        {'user_id': user_id, 'symbol': symbol, 'quantity': 10, 'average_cost': 100.0, 'total_cost': 1000.0}
+        for symbol in symbols
+    ])
+
+
+def bench_size(db, n_symbols, runs, replay_path):
+    symbols = write_replay_file(replay_path, n_symbols)
+    seed_holdings(db, symbols)
+    samples = []
+    for _ in range(runs):
+        provider = ReplayProvider(replay_path)
+        start = time.perf_counter()
+        timings = update_stock_prices(providers=[provider], database=db, force=True)
+        samples.append(time.perf_counter() - start)
+        # The replay must price everything, or the timings mean nothing
+        assert timings and provider.quotes_returned == n_symbols
+    assert db.prices.count_documents({}) == n_symbols
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='symbol universe sizes')
+    parser.add_argument('--runs', type=int, default=3, help='refreshes per size')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare against results saved with --save')
+    args = parser.parse_args()
+
+    client = MongoClient(MONGO_URI)
+    db = client[BENCH_DB]
+    results = {}
+    replay_path = os.path.join(tempfile.mkdtemp(), 'quotes.json')
+    # update_stock_prices prints every step; keep the table readable
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    try:
+        for n_symbols in args.sizes:
+            seconds = bench_size(db, n_symbols, args.runs, replay_path)
+            results[str(n_symbols)] = {'seconds': seconds, 'symbols_per_sec': n_symbols / seconds}
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        client.drop_database(BENCH_DB)
+        if os.path.exists(replay_path):
+            os.remove(replay_path)
+        os.rmdir(os.path.dirname(replay_path))
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    regressions = []
+    print(f"{'symbols':>8} | {'p50 (s)':>8} | {'symbols/sec':>12} | baseline")
+    for size, result in results.items():
+        line = f"{size:>8} | {result['seconds']:>8.3f} | {result['symbols_per_sec']:>12,.0f} |"
+        if size in baseline:
+            change = result['symbols_per_sec'] / baseline[size]['symbols_per_sec'] - 1
+            line += f" {change:+.0%}"
+            if change < -REGRESSION_TOLERANCE:
+                line += " REGRESSION"
+                regressions.append(size)
+        print(line)
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+# csv_import.py
+"""Streaming import of a broker CSV export (Symbol, Quantity, Price columns).
+
+The upload is decoded and parsed as a stream, and rows are written with
+insert_many(ordered=False) in chunks of IMPORT_CHUNK_SIZE, so memory stays
+bounded by the chunk size rather than the file size. Every imported row is
+tagged with the import's id: only when the whole file has been read are the
+user's previous transactions removed, and if the import fails midway its
+own rows are removed instead, leaving the old portfolio untouched.
+
+Holdings are not touched here; the caller rebuilds them once at the end.
+"""
+import csv
+import io
+import time
+import uuid
+from datetime import datetime
+
+from pymongo.errors import BulkWriteError
+
+IMPORT_CHUNK_SIZE = 5000
+MAX_REPORTED_ERRORS = 50
+
+
+class ImportAbandoned(Exception):
+    """Raised when the import's owner gave it up (e.g. expired it as stalled) before it finished."""
+
+
+class ImportStats:
+    """Counters reported at the end of an import."""
+
+    def __init__(self):
+        self.rows = 0
+        self.imported = 0
+        self.rejected = 0
+        self.errors = []
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def reject(self, line_no, message):
+        self.rejected += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(f"Line {line_no}: {message}")
+
+    @property
+    def rows_per_sec(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def summary(self):
+        return (f"Imported {self.imported} of {self.rows} rows in {self.elapsed:.1f}s "
+                f"({self.rows_per_sec:,.0f} rows/sec, {self.rejected} rejected).")
+
+
+def parse_row(row):
+    """Returns (symbol, quantity, price) for a CSV row, or raises ValueError."""
+    symbol = (row.get('Symbol') or '').strip().upper()
+    if not symbol:
+        raise ValueError("missing Symbol")
+    try:
+        quantity = float(row['Quantity'])
+        price = float(row['Price'])
+    except KeyError as e:
+        raise ValueError(f"{symbol}: missing expected column - {e}")
+    except (TypeError, ValueError):
+        raise ValueError(f"{symbol}: invalid quantity or price format")
+    if quantity <= 0 or price <= 0:
+        raise ValueError(f"{symbol}: quantity and price must be positive")
+    return symbol, quantity, price
+
+
+def _insert_chunk(collection, docs, stats):
+    try:
+        stats.imported += len(collection.insert_many(docs, ordered=False).inserted_ids)
+    except BulkWriteError as e:
+        # ordered=False keeps going past bad documents; count what made it in
+        stats.imported += e.details.get('nInserted', 0)
+        for error in e.details.get('writeErrors', []):
+            stats.reject(f"chunk row {error.get('index')}", error.get('errmsg'))
+
+
+def import_transactions(db, user_id, binary_stream, chunk_size=IMPORT_CHUNK_SIZE, import_id=None,
+                        progress=None, confirm=None):
+    """Replaces the user's transactions with the rows of a CSV upload; returns the ImportStats.
+
+    progress(stats) is called after every chunk. confirm() is called right
+    before the user's previous transactions are deleted; if it returns False
+    the import is abandoned instead. Decoding or CSV errors, and
+    ImportAbandoned (which progress may raise too), propagate after this
+    import's rows have been removed.
+    """
+    stats = ImportStats()
+    import_id = import_id or uuid.uuid4().hex
+    # All rows of one upload share its import time
+    now = datetime.utcnow()
+    text_stream = io.TextIOWrapper(binary_stream, encoding='utf-8-sig', newline='')
+    reader = csv.DictReader(text_stream)
+
+    chunk = []
+    try:
+        for row in reader:
+            stats.rows += 1
+            try:
+                symbol, quantity, price = parse_row(row)
+            except ValueError as e:
+                stats.reject(reader.line_num, e)
+                continue
+            chunk.append({'user_id': user_id, 'symbol': symbol, 'quantity': quantity, 'price': price,
+                          'date': now, 'import_id': import_id})
+            if len(chunk) >= chunk_size:
+                _insert_chunk(db.transactions, chunk, stats)
+                chunk = []
+                if progress:
+                    progress(stats)
+        if chunk:
+            _insert_chunk(db.transactions, chunk, stats)
+        if stats.imported and confirm and not confirm():
+            raise ImportAbandoned("The import was given up before it finished.")
+    except Exception:
+        db.transactions.delete_many({'user_id': user_id, 'import_id': import_id})
+        raise
+    finally:
+        stats.elapsed = time.perf_counter() - stats.started
+        # Hand the binary stream back to the caller open, instead of closing it with the wrapper
+        text_stream.detach()
+
+    if stats.imported:
+        db.transactions.delete_many({'user_id': user_id, 'import_id': {'$ne': import_id}})
+    return stats
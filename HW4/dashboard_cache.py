@@ -0,0 +1,79 @@
+# dashboard_cache.py
+"""Per-user cache of the computed dashboard (enriched holdings and totals).
+
+A snapshot is valid for one (holdings version, prices version) pair:
+
+- users.holdings_version is bumped by invalidate_dashboard() on every write
+  that changes a user's holdings;
+- meta {_id: 'prices'} carries a global version and the last refresh time,
+  bumped by update_stock_prices when a refresh completes.
+
+Both live in Mongo, so a write handled by one gunicorn worker (or the price
+updater process) invalidates the snapshots every other worker holds. Checking
+them costs two _id lookups instead of the holdings/prices queries and totals.
+"""
+import threading
+from collections import OrderedDict
+
+from pymongo import DESCENDING, ReturnDocument
+
+PRICES_META_ID = 'prices'
+# Snapshots kept per process; least recently viewed users are dropped first
+DASHBOARD_CACHE_SIZE = 1000
+
+_snapshots = OrderedDict()
+_lock = threading.Lock()
+
+
+def prices_version(db):
+    """Returns the {version, last_updated} stamp, seeding it from the prices collection the first time."""
+    meta = db.meta.find_one({'_id': PRICES_META_ID})
+    if meta is None:
+        latest = db.prices.find_one(sort=[('last_updated', DESCENDING)], projection={'last_updated': 1})
+        meta = db.meta.find_one_and_update(
+            {'_id': PRICES_META_ID},
+            {'$setOnInsert': {'version': 0, 'last_updated': latest.get('last_updated') if latest else None}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    return meta
+
+
+def bump_prices_version(db, last_updated):
+    """Called once a price refresh has written its quotes."""
+    db.meta.update_one(
+        {'_id': PRICES_META_ID},
+        {'$inc': {'version': 1}, '$set': {'last_updated': last_updated}},
+        upsert=True
+    )
+
+
+def invalidate_dashboard(db, user_id=None):
+    """Marks a user's snapshot (or every user's, for user_id=None) as stale in all workers."""
+    db.users.update_many({'_id': user_id} if user_id is not None else {}, {'$inc': {'holdings_version': 1}})
+    with _lock:
+        if user_id is None:
+            _snapshots.clear()
+        else:
+            _snapshots.pop(user_id, None)
+
+
+def get_dashboard(db, user_id, build):
+    """Returns the user's cached snapshot, or calls build() and caches its result."""
+    user = db.users.find_one({'_id': user_id}, {'holdings_version': 1})
+    meta = prices_version(db)
+    key = ((user or {}).get('holdings_version', 0), meta['version'])
+    with _lock:
+        cached = _snapshots.get(user_id)
+        if cached is not None and cached[0] == key:
+            _snapshots.move_to_end(user_id)
+            return cached[1]
+
+    snapshot = build()
+    snapshot['last_updated'] = meta.get('last_updated')
+    with _lock:
+        _snapshots[user_id] = (key, snapshot)
+        _snapshots.move_to_end(user_id)
+        while len(_snapshots) > DASHBOARD_CACHE_SIZE:
+            _snapshots.popitem(last=False)
+    return snapshot
@@ -4,19 +4,42 @@ from flask_wtf.csrf import CSRFProtect
 from pymongo import MongoClient
 from dotenv import load_dotenv
 import os
-import sys
+import threading
 
 load_dotenv()
+MONGO_URI = os.getenv("MONGO_URI")
 
-try:
-    client = MongoClient(os.getenv("MONGO_URI"), serverSelectionTimeoutMS=5000)
-    client.server_info()
-    db = client.stock_portfolio_db
-    print("Successfully connected to MongoDB.")
-except Exception as e:
-    print("FATAL: Could not connect to MongoDB. Please check your MONGO_URI and network access.", file=sys.stderr)
-    print(f"Error details: {e}", file=sys.stderr)
-    sys.exit(1)
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Returns this process's MongoClient, creating it on first use.
+
+    Nothing connects at import time, so workers boot without a round trip to
+    the server. A client must not be used across fork(), so a forked worker
+    (e.g. under gunicorn --preload) gets its own instead of the parent's.
+    """
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        with _client_lock:
+            if _client is None or _client_pid != os.getpid():
+                _client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000, connect=False)
+                _client_pid = os.getpid()
+    return _client
+
+def get_db():
+    return get_client().stock_portfolio_db
+
+class LazyDatabase:
+    """Stands in for stock_portfolio_db so modules can keep `from extensions import db`."""
+    def __getattr__(self, name):
+        return getattr(get_db(), name)
+
+    def __getitem__(self, name):
+        return get_db()[name]
+
+db = LazyDatabase()
 
 login_manager = LoginManager()
 login_manager.login_view = 'auth.login'
@@ -0,0 +1,160 @@
+# import_jobs.py
+"""Background CSV imports, so an upload is no longer bounded by the HTTP timeout.
+
+The request only saves the upload to a temp file and records a job in
+`import_jobs`:
+
+    {_id: job_id, user_id, filename, status, active, bytes_total, bytes_read,
+     rows, imported, rejected, errors, summary, error, created_at, updated_at, finished_at}
+
+status goes queued -> running -> succeeded / failed. A background worker runs
+csv_import.import_transactions on the file, writing progress to the job after
+every chunk, and the import modal polls GET /import_jobs/<job_id>. A user has
+at most one active import (unique partial index in indexes.py), since each
+import replaces the user's whole transaction history.
+"""
+import csv
+import os
+import tempfile
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from pymongo.errors import DuplicateKeyError
+
+from background import LazyExecutor
+from csv_import import MAX_REPORTED_ERRORS, ImportAbandoned, import_transactions
+from extensions import db
+
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", 2))
+# Uploads wait here until their job has run; defaults to the system temp dir
+IMPORT_UPLOAD_DIR = os.getenv("IMPORT_UPLOAD_DIR") or None
+# A running import touches updated_at every JOB_HEARTBEAT, so one stuck for
+# JOB_STALL_TIMEOUT has lost the process running it
+JOB_HEARTBEAT = timedelta(minutes=1)
+JOB_STALL_TIMEOUT = timedelta(minutes=10)
+
+_executor = LazyExecutor(max_workers=IMPORT_WORKERS, thread_name_prefix='csv-import')
+
+
+class ImportInProgress(Exception):
+    """Raised when the user already has an import queued or running."""
+
+
+def _expire_stalled_jobs(now):
+    for job in db.import_jobs.find({'active': True, 'updated_at': {'$lt': now - JOB_STALL_TIMEOUT}}, {'_id': 1}):
+        # Its worker is gone: drop the rows it had written so far, the user's old history is still intact
+        db.transactions.delete_many({'import_id': job['_id']})
+        db.import_jobs.update_one(
+            {'_id': job['_id']},
+            {'$set': {'status': 'failed', 'error': 'The import was interrupted.', 'finished_at': now}, '$unset': {'active': ''}}
+        )
+
+
+def start_import(user_id, upload, on_imported):
+    """Saves the upload and queues its import; on_imported(user_id) runs after a successful one.
+
+    Returns the job document, or raises ImportInProgress.
+    """
+    now = datetime.utcnow()
+    _expire_stalled_jobs(now)
+
+    job_id = uuid.uuid4().hex
+    job = {
+        '_id': job_id, 'user_id': user_id, 'filename': upload.filename, 'status': 'queued', 'active': True,
+        'bytes_total': 0, 'bytes_read': 0, 'rows': 0, 'imported': 0, 'rejected': 0, 'errors': [],
+        'created_at': now, 'updated_at': now
+    }
+    try:
+        db.import_jobs.insert_one(job)
+    except DuplicateKeyError:
+        raise ImportInProgress("An import is already running for your account.")
+
+    fd, path = tempfile.mkstemp(prefix='import-', suffix='.csv', dir=IMPORT_UPLOAD_DIR)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            upload.save(f)
+        job['bytes_total'] = os.path.getsize(path)
+    except Exception:
+        os.remove(path)
+        db.import_jobs.delete_one({'_id': job_id})
+        raise
+    db.import_jobs.update_one({'_id': job_id}, {'$set': {'bytes_total': job['bytes_total']}})
+
+    _executor.submit(run_import_job, job_id, user_id, path, on_imported)
+    return job
+
+
+def run_import_job(job_id, user_id, path, on_imported):
+    started = db.import_jobs.update_one({'_id': job_id, 'active': True}, {'$set': {'status': 'running', 'updated_at': datetime.utcnow()}})
+    if not started.matched_count:
+        # Expired as stalled while it waited in the queue
+        os.remove(path)
+        return
+    # Keeps updated_at moving through every phase (including the final delete and the
+    # holdings rebuild), so only a job whose process died is ever expired as stalled
+    stop_heartbeat = threading.Event()
+    def heartbeat():
+        while not stop_heartbeat.wait(JOB_HEARTBEAT.total_seconds()):
+            db.import_jobs.update_one({'_id': job_id, 'active': True}, {'$set': {'updated_at': datetime.utcnow()}})
+    threading.Thread(target=heartbeat, name=f'csv-import-heartbeat-{job_id}', daemon=True).start()
+
+    def still_active():
+        return db.import_jobs.update_one({'_id': job_id, 'active': True}, {'$set': {'updated_at': datetime.utcnow()}}).matched_count == 1
+
+    result = {'status': 'succeeded'}
+    try:
+        with open(path, 'rb') as f:
+            def progress(stats):
+                updated = db.import_jobs.update_one({'_id': job_id, 'active': True}, {'$set': {
+                    'bytes_read': f.tell(), 'rows': stats.rows, 'imported': stats.imported,
+                    'rejected': stats.rejected, 'updated_at': datetime.utcnow()
+                }})
+                if not updated.matched_count:
+                    raise ImportAbandoned("The import was expired while it ran.")
+
+            # still_active guards the delete of the old history: an expired job must not replace it
+            stats = import_transactions(db, user_id, f, import_id=job_id, progress=progress, confirm=still_active)
+            result['bytes_read'] = f.tell()
+        if stats.imported:
+            on_imported(user_id)
+            result['summary'] = stats.summary()
+        else:
+            result['summary'] = "No valid transactions found in the CSV file. Your existing data was kept."
+        result.update({'rows': stats.rows, 'imported': stats.imported, 'rejected': stats.rejected, 'errors': stats.errors})
+        print(f"CSV import {job_id}: {stats.summary()}")
+    except ImportAbandoned as e:
+        print(f"CSV import {job_id} abandoned: {e}")
+        result = {'status': 'failed', 'error': 'The import was interrupted.'}
+    except UnicodeDecodeError:
+        result = {'status': 'failed', 'error': "Error decoding file. Please ensure the CSV is UTF-8 encoded."}
+    except csv.Error as e:
+        result = {'status': 'failed', 'error': f"Error parsing CSV file: {e}"}
+    except Exception as e:
+        print(f"CSV import {job_id} failed: {e}")
+        result = {'status': 'failed', 'error': f"An unexpected error occurred during CSV import: {e}"}
+    finally:
+        stop_heartbeat.set()
+        os.remove(path)
+    now = datetime.utcnow()
+    result.update({'finished_at': now, 'updated_at': now})
+    # A job that was expired meanwhile already carries its final state
+    db.import_jobs.update_one({'_id': job_id, 'active': True}, {'$set': result, '$unset': {'active': ''}})
+
+
+def import_status(job):
+    """The JSON view of a job document."""
+    done = job['status'] in ('succeeded', 'failed')
+    return {
+        'job_id': job['_id'],
+        'status': job['status'],
+        'done': done,
+        # Reading ends before the old history is cleared and holdings are rebuilt, so hold at 99 until done
+        'percent': 100 if done else min(99, int(100 * job['bytes_read'] / job['bytes_total'])) if job['bytes_total'] else 0,
+        'rows': job['rows'],
+        'imported': job['imported'],
+        'rejected': job['rejected'],
+        'errors': job['errors'][:MAX_REPORTED_ERRORS],
+        'summary': job.get('summary'),
+        'error': job.get('error'),
+    }
@@ -0,0 +1,121 @@
+# indexes.py
+"""Index management for stock_portfolio_db.
+
+ensure_indexes() is idempotent and runs at app startup; check_query_plans()
+explains the queries the routes and the price updater run and flags any that
+fall back to a COLLSCAN.
+
+Usage: python indexes.py [--check]
+"""
+import sys
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+from dashboard_cache import PRICES_META_ID
+
+INDEXES = {
+    'transactions': [
+        # recalculate_holding / rebuild_holdings filter on {user_id, symbol}; the history page filters by symbol
+        # and pages on (date, _id), which the trailing keys serve without an in-memory sort
+        IndexModel([('user_id', ASCENDING), ('symbol', ASCENDING), ('date', DESCENDING), ('_id', DESCENDING)], name='user_symbol_date_id'),
+        # Transaction history pages through a user's trades on (date, _id)
+        IndexModel([('user_id', ASCENDING), ('date', DESCENDING), ('_id', DESCENDING)], name='user_date_id'),
+    ],
+    'holdings': [
+        IndexModel([('user_id', ASCENDING), ('symbol', ASCENDING)], name='user_symbol', unique=True),
+        # update_stock_prices(force=True) runs distinct("symbol")
+        IndexModel([('symbol', ASCENDING)], name='symbol'),
+    ],
+    'prices': [
+        IndexModel([('symbol', ASCENDING)], name='symbol', unique=True),
+        # prices_version seeds the dashboard's prices stamp from the most recent last_updated
+        IndexModel([('last_updated', DESCENDING)], name='last_updated'),
+    ],
+    'users': [
+        IndexModel([('username', ASCENDING)], name='username', unique=True),
+    ],
+    'refresh_jobs': [
+        # At most one queued/running refresh; concurrent requests join it
+        IndexModel([('active', ASCENDING)], name='one_active', unique=True, partialFilterExpression={'active': True}),
+        # Finished jobs are only kept around for status polls
+        IndexModel([('finished_at', ASCENDING)], name='finished_at_ttl', expireAfterSeconds=24 * 3600),
+    ],
+    'import_jobs': [
+        # Each import replaces the user's history, so only one may be queued/running per user
+        IndexModel([('user_id', ASCENDING)], name='one_active_per_user', unique=True, partialFilterExpression={'active': True}),
+        IndexModel([('finished_at', ASCENDING)], name='finished_at_ttl', expireAfterSeconds=24 * 3600),
+    ],
+    'price_update_runs': [
+        # The price daemon's run metrics are kept for a week
+        IndexModel([('started_at', ASCENDING)], name='started_at_ttl', expireAfterSeconds=7 * 24 * 3600),
+    ],
+}
+
+
+# Indexes superseded by ones in INDEXES (same leading keys), dropped when still present
+RETIRED_INDEXES = {
+    'transactions': ['user_symbol_date', 'user_date'],
+}
+
+
+def ensure_indexes(db):
+    """Creates every index in INDEXES and drops RETIRED_INDEXES; existing ones are left untouched."""
+    for collection, names in RETIRED_INDEXES.items():
+        existing = db[collection].index_information()
+        for name in names:
+            if name in existing:
+                db[collection].drop_index(name)
+    for collection, models in INDEXES.items():
+        try:
+            db[collection].create_indexes(models)
+        except OperationFailure as e:
+            # e.g. duplicate usernames/symbols left over from before the unique index existed
+            print(f"Could not create indexes on {collection}: {e}", file=sys.stderr)
+
+
+def _route_queries(db, user_id):
+    """(description, explain output) for each hot query the app runs."""
+    yield 'index: holdings by user', db.holdings.find({'user_id': user_id}).sort('symbol', ASCENDING).explain()
+    yield 'index: prices by symbol', db.prices.find({'symbol': {'$in': ['AAPL', '2330.TW']}}).explain()
+    yield 'index: prices version stamp', db.meta.find({'_id': PRICES_META_ID}).explain()
+    yield 'index: holdings version', db.users.find({'_id': user_id}, {'holdings_version': 1}).explain()
+    history_sort = [('date', DESCENDING), ('_id', DESCENDING)]
+    yield 'transactions: history', db.transactions.find({'user_id': user_id}).sort(history_sort).limit(51).explain()
+    yield 'transactions: history by symbol', db.transactions.find({'user_id': user_id, 'symbol': 'AAPL'}).sort(history_sort).limit(51).explain()
+    yield 'holdings: recalculate', db.command('aggregate', 'transactions', pipeline=[
+        {'$match': {'user_id': user_id, 'symbol': 'AAPL'}},
+        {'$group': {'_id': '$symbol', 'total_quantity': {'$sum': '$quantity'}}}
+    ], explain=True)
+    yield 'auth: user by username', db.users.find({'username': 'alice'}).explain()
+    yield 'prices: distinct held symbols', db.command('explain', {'distinct': 'holdings', 'key': 'symbol'})
+    yield 'prices: refresh plan freshness', db.prices.find(
+        {'symbol': {'$in': ['AAPL', '2330.TW']}}, {'symbol': 1, 'last_updated': 1}).explain()
+
+
+def _has_collscan(plan):
+    if isinstance(plan, dict):
+        if plan.get('stage') == 'COLLSCAN':
+            return True
+        return any(_has_collscan(v) for k, v in plan.items() if k != 'rejectedPlans')
+    if isinstance(plan, list):
+        return any(_has_collscan(v) for v in plan)
+    return False
+
+
+def check_query_plans(db):
+    """Returns the descriptions of route queries whose winning plan is a COLLSCAN."""
+    return [name for name, plan in _route_queries(db, ObjectId()) if _has_collscan(plan)]
+
+
+if __name__ == "__main__":
+    from extensions import db
+
+    ensure_indexes(db)
+    print("Indexes are up to date.")
+    if '--check' in sys.argv:
+        collscans = check_query_plans(db)
+        for name in collscans:
+            print(f"COLLSCAN: {name}")
+        print("No collection scans found." if not collscans else f"{len(collscans)} query(ies) need an index.")
+        sys.exit(1 if collscans else 0)
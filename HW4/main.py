@@ -1,40 +1,178 @@
 # main.py
-from flask import Blueprint, render_template, request, flash, redirect, url_for, Response, session
+from flask import Blueprint, render_template, request, flash, redirect, url_for, Response, jsonify
 from flask_login import login_required, current_user
 from bson.objectid import ObjectId
+from bson.errors import InvalidId
 from datetime import datetime, timedelta
 import io
 import csv
+import zlib
+import click
 from extensions import db
-from pymongo import DESCENDING
-from update_prices import update_stock_prices
+from pymongo import DESCENDING, ReturnDocument, ReplaceOne, DeleteOne
+from refresh_jobs import claim_refresh_slot, enqueue_refresh, job_status
+from dashboard_cache import get_dashboard, invalidate_dashboard
+from import_jobs import ImportInProgress, start_import, import_status
+from models import USER_CACHE_TTL, set_user_role
 
-bp = Blueprint('main', __name__)
+bp = Blueprint('main', __name__, cli_group=None)
+
+# Holdings at or below this quantity are treated as closed positions
+HOLDING_EPSILON = 0.000001
 
 def recalculate_holding(user_id, symbol):
-    """Recalculates a single holding's state based on all its transactions."""
+    """Recalculates a single holding's state based on all its transactions.
+
+    This full re-aggregation is the consistency path; everyday writes go through
+    apply_holding_delta instead.
+    """
     pipeline = [
         {'$match': {'user_id': user_id, 'symbol': symbol}},
         {'$group': {'_id': '$symbol', 'total_quantity': {'$sum': '$quantity'}, 'total_cost': {'$sum': {'$multiply': ['$quantity', '$price']}}}}
     ]
     result = list(db.transactions.aggregate(pipeline))
-    db.holdings.delete_one({'user_id': user_id, 'symbol': symbol})
-    if result and result[0]['total_quantity'] > 0.000001:
+    if result and result[0]['total_quantity'] > HOLDING_EPSILON:
         agg = result[0]
-        db.holdings.insert_one({'user_id': user_id, 'symbol': symbol, 'quantity': agg['total_quantity'], 'cost_basis': agg['total_cost'], 'average_cost': agg['total_cost'] / agg['total_quantity']})
+        # Replace in place so the holding is never briefly missing
+        db.holdings.replace_one(
+            {'user_id': user_id, 'symbol': symbol},
+            {'user_id': user_id, 'symbol': symbol, 'quantity': agg['total_quantity'], 'cost_basis': agg['total_cost'], 'average_cost': agg['total_cost'] / agg['total_quantity']},
+            upsert=True
+        )
+    else:
+        db.holdings.delete_one({'user_id': user_id, 'symbol': symbol})
+    invalidate_dashboard(db, user_id)
+
+def apply_holding_delta(user_id, symbol, quantity_delta, cost_delta):
+    """Applies one transaction's change to a holding with a single atomic upsert (O(1) per trade)."""
+    holding = db.holdings.find_one_and_update(
+        {'user_id': user_id, 'symbol': symbol},
+        [
+            {'$set': {
+                'quantity': {'$add': [{'$ifNull': ['$quantity', 0]}, quantity_delta]},
+                'cost_basis': {'$add': [{'$ifNull': ['$cost_basis', 0]}, cost_delta]}
+            }},
+            {'$set': {
+                'average_cost': {'$cond': [{'$gt': ['$quantity', HOLDING_EPSILON]}, {'$divide': ['$cost_basis', '$quantity']}, 0]}
+            }}
+        ],
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    if holding['quantity'] <= HOLDING_EPSILON:
+        # Only remove it if no concurrent write has reopened the position meanwhile
+        db.holdings.delete_one({'_id': holding['_id'], 'quantity': {'$lte': HOLDING_EPSILON}})
+    invalidate_dashboard(db, user_id)
+
+# Holding writes sent per bulk_write when rebuilding many users at once
+REBUILD_BATCH_SIZE = 1000
+
+def rebuild_holdings(user_id=None, symbols=None):
+    """Recomputes holdings from transactions with one $group-by-symbol aggregation.
+
+    Scope it to a user and optionally to some of their symbols; with no
+    arguments every user's holdings are rebuilt. All holding writes go out
+    through bulk_write, and positions that no longer exist are removed.
+    Returns the number of holdings written or removed.
+    """
+    match = {}
+    if user_id is not None:
+        match['user_id'] = user_id
+    if symbols is not None:
+        match['symbol'] = {'$in': list(symbols)}
 
-@bp.route('/')
-@login_required
-def index():
-    """Main dashboard route, reads data only from the database."""
-    user_id = ObjectId(current_user.id)
+    pipeline = [
+        {'$match': match},
+        {'$group': {'_id': {'user_id': '$user_id', 'symbol': '$symbol'}, 'total_quantity': {'$sum': '$quantity'}, 'total_cost': {'$sum': {'$multiply': ['$quantity', '$price']}}}}
+    ]
+    operations, kept, written = [], set(), 0
+    for agg in db.transactions.aggregate(pipeline):
+        if agg['total_quantity'] <= HOLDING_EPSILON:
+            continue
+        key = (agg['_id']['user_id'], agg['_id']['symbol'])
+        kept.add(key)
+        operations.append(ReplaceOne(
+            {'user_id': key[0], 'symbol': key[1]},
+            {'user_id': key[0], 'symbol': key[1], 'quantity': agg['total_quantity'], 'cost_basis': agg['total_cost'], 'average_cost': agg['total_cost'] / agg['total_quantity']},
+            upsert=True
+        ))
+    for h in db.holdings.find(match, {'user_id': 1, 'symbol': 1}):
+        if (h['user_id'], h['symbol']) not in kept:
+            operations.append(DeleteOne({'_id': h['_id']}))
+
+    for start in range(0, len(operations), REBUILD_BATCH_SIZE):
+        db.holdings.bulk_write(operations[start:start + REBUILD_BATCH_SIZE], ordered=False)
+        written += len(operations[start:start + REBUILD_BATCH_SIZE])
+    if written:
+        invalidate_dashboard(db, user_id)
+    return written
+
+@bp.cli.command('rebuild-holdings')
+@click.option('--username', help='Only rebuild this user\'s holdings.')
+def rebuild_holdings_command(username):
+    """Rebuild holdings from transactions (all users by default)."""
+    user_id = None
+    if username:
+        user = db.users.find_one({'username': username}, {'_id': 1})
+        if not user:
+            raise click.ClickException(f"No user named {username}.")
+        user_id = user['_id']
+    print(f"Rebuilt holdings: {rebuild_holdings(user_id)} holding(s) written or removed.")
+
+def check_holdings(user_id=None, repair=True):
+    """Compares stored holdings against a full re-aggregation of transactions.
+
+    Returns the (user_id, symbol) pairs that had drifted; with repair=True they
+    are rebuilt with recalculate_holding.
+    """
+    match = {'user_id': user_id} if user_id else {}
+    expected = {
+        (r['_id']['user_id'], r['_id']['symbol']): r
+        for r in db.transactions.aggregate([
+            {'$match': match},
+            {'$group': {'_id': {'user_id': '$user_id', 'symbol': '$symbol'}, 'total_quantity': {'$sum': '$quantity'}, 'total_cost': {'$sum': {'$multiply': ['$quantity', '$price']}}}}
+        ])
+        if r['total_quantity'] > HOLDING_EPSILON
+    }
+    stored = {(h['user_id'], h['symbol']): h for h in db.holdings.find(match)}
+
+    drifted = []
+    for key in expected.keys() | stored.keys():
+        agg, holding = expected.get(key), stored.get(key)
+        if agg is None or holding is None \
+                or abs(holding['quantity'] - agg['total_quantity']) > HOLDING_EPSILON \
+                or abs(holding['cost_basis'] - agg['total_cost']) > 0.01:
+            drifted.append(key)
+            if repair:
+                recalculate_holding(*key)
+    return drifted
+
+@bp.cli.command('check-holdings')
+def check_holdings_command():
+    """Verify (and repair) every holding against its transactions."""
+    drifted = check_holdings()
+    for user_id, symbol in drifted:
+        print(f"Repaired holding {symbol} for user {user_id}")
+    print(f"Holdings check finished: {len(drifted)} holding(s) repaired.")
+
+@bp.cli.command('set-role')
+@click.argument('username')
+@click.argument('role')
+def set_role_command(username, role):
+    """Change a user's role."""
+    user = db.users.find_one({'username': username}, {'_id': 1})
+    if not user:
+        raise click.ClickException(f"No user named {username}.")
+    set_user_role(user['_id'], role)
+    # This process can't clear the web workers' caches; their cached copy expires after USER_CACHE_TTL seconds
+    print(f"{username} is now '{role}' (live sessions pick it up within {USER_CACHE_TTL}s).")
+
+def build_dashboard(user_id):
+    """Computes the dashboard snapshot: holdings enriched with prices, plus grand totals."""
     holdings = list(db.holdings.find({'user_id': user_id}).sort('symbol', 1))
     
     price_data_cursor = db.prices.find({'symbol': {'$in': [h['symbol'] for h in holdings]}})
     price_map = {p['symbol']: p for p in price_data_cursor}
-    
-    latest_update_record = db.prices.find_one(sort=[("last_updated", DESCENDING)])
-    last_updated_time = latest_update_record.get('last_updated') if latest_update_record else None
 
     total_market_value, total_cost_basis, total_day_change = 0, 0, 0
     
@@ -59,38 +197,101 @@ def index():
             total_day_change += h['day_change']
             
     grand_total = {'market_value': total_market_value, 'cost_basis': total_cost_basis, 'total_gain_loss': total_market_value - total_cost_basis, 'day_change': total_day_change}
-    
-    return render_template('index.html', holdings=holdings, grand_total=grand_total, last_updated=last_updated_time)
+    return {'holdings': holdings, 'grand_total': grand_total}
+
+@bp.route('/')
+@login_required
+def index():
+    """Main dashboard route, served from the per-user snapshot cache."""
+    user_id = ObjectId(current_user.id)
+    dashboard = get_dashboard(db, user_id, lambda: build_dashboard(user_id))
+    return render_template('index.html', holdings=dashboard['holdings'], grand_total=dashboard['grand_total'], last_updated=dashboard['last_updated'])
 
 @bp.route('/refresh_prices', methods=['POST'])
 @login_required
 def refresh_prices_route():
-    """Manually triggers the price update script."""
-    five_minutes_ago = datetime.utcnow() - timedelta(minutes=5)
-    last_refresh_str = session.get('last_refresh')
-    if last_refresh_str:
-        last_refresh = datetime.fromisoformat(last_refresh_str)
-        if last_refresh > five_minutes_ago:
-            flash("You can only refresh prices once every 5 minutes.", "warning")
-            return redirect(url_for('main.index'))
+    """Queues a background price refresh; JSON callers get the job to poll, form posts a flash message."""
+    wants_json = request.accept_mimetypes.best == 'application/json'
+    user_id = ObjectId(current_user.id)
 
-    try:
-        print("--- [Manual Trigger] Running Price Update ---")
-        update_stock_prices()
-        session['last_refresh'] = datetime.utcnow().isoformat()
-        flash("Price data has been updated successfully!", "success")
-    except Exception as e:
-        flash(f"An error occurred during the update: {e}", "danger")
-        print(f"Manual refresh failed: {e}")
+    wait = claim_refresh_slot(user_id)
+    if wait:
+        message = f"You can only refresh prices once every 5 minutes. Try again in {(wait + 59) // 60} minute(s)."
+        if wants_json:
+            return jsonify({'error': message, 'retry_after': wait}), 429, {'Retry-After': str(wait)}
+        flash(message, "warning")
+        return redirect(url_for('main.index'))
 
+    job, coalesced = enqueue_refresh(user_id)
+    if wants_json:
+        return jsonify(dict(job_status(job), coalesced=coalesced)), 202
+    flash("Price refresh started. Reload the page in a moment to see the new prices.", "info")
     return redirect(url_for('main.index'))
 
+@bp.route('/refresh_prices/<job_id>')
+@login_required
+def refresh_status_route(job_id):
+    """JSON status of a refresh job, polled by the dashboard; only for users who requested it."""
+    job = db.refresh_jobs.find_one({'_id': job_id, 'requested_by': ObjectId(current_user.id)})
+    if job is None:
+        return jsonify({'error': 'Unknown refresh job.'}), 404
+    return jsonify(job_status(job))
+
+# Transaction history page size, overridable with ?limit= up to the maximum
+TRANSACTIONS_PAGE_SIZE = 50
+MAX_TRANSACTIONS_PAGE_SIZE = 200
+
+def encode_page_token(transaction):
+    """Builds the ?after= token pointing just past the given transaction."""
+    return f"{transaction['date'].isoformat()}_{transaction['_id']}"
+
+def decode_page_token(token):
+    """Parses an ?after= token back into a (date, _id) position."""
+    date, transaction_id = token.rsplit('_', 1)
+    return datetime.fromisoformat(date), ObjectId(transaction_id)
+
+def transactions_query(user_id, symbol=None, start=None, end=None, after=None):
+    """Builds the history filter; every condition is served by the user_symbol_date_id / user_date_id indexes."""
+    query = {'user_id': user_id}
+    if symbol:
+        query['symbol'] = symbol
+    if start or end:
+        query['date'] = {}
+        if start:
+            query['date']['$gte'] = start
+        if end:
+            query['date']['$lt'] = end
+    if after:
+        date, transaction_id = after
+        query['$or'] = [{'date': {'$lt': date}}, {'date': date, '_id': {'$lt': transaction_id}}]
+    return query
+
 @bp.route('/transactions')
 @login_required
 def list_transactions():
+    """Transaction history, newest first, one keyset page at a time."""
     user_id = ObjectId(current_user.id)
-    transactions = list(db.transactions.find({'user_id': user_id}).sort('date', DESCENDING))
-    return render_template('transactions.html', transactions=transactions)
+    symbol = request.args.get('symbol', '').strip().upper()
+    filters = {'symbol': symbol, 'start': request.args.get('start', ''), 'end': request.args.get('end', '')}
+    try:
+        page_size = min(max(int(request.args.get('limit', TRANSACTIONS_PAGE_SIZE)), 1), MAX_TRANSACTIONS_PAGE_SIZE)
+        start = datetime.strptime(filters['start'], '%Y-%m-%d') if filters['start'] else None
+        # The end date is inclusive, so stop before the following midnight
+        end = datetime.strptime(filters['end'], '%Y-%m-%d') + timedelta(days=1) if filters['end'] else None
+        after = decode_page_token(request.args['after']) if request.args.get('after') else None
+    except (ValueError, InvalidId):
+        flash("Invalid filter or page.", "danger")
+        return redirect(url_for('main.list_transactions'))
+
+    cursor = db.transactions.find(
+        transactions_query(user_id, symbol, start, end, after),
+        {'symbol': 1, 'quantity': 1, 'price': 1, 'date': 1}
+    ).sort([('date', DESCENDING), ('_id', DESCENDING)]).limit(page_size + 1)
+    transactions = list(cursor)
+    # The extra row only tells us whether an older page exists
+    next_token = encode_page_token(transactions[page_size - 1]) if len(transactions) > page_size else None
+    return render_template('transactions.html', transactions=transactions[:page_size], filters=filters,
+                           page_size=page_size, after=request.args.get('after'), next_token=next_token)
 
 @bp.route('/add_transaction', methods=['POST'])
 @login_required
@@ -120,7 +321,7 @@ def add_transaction_route():
             'price': price,
             'date': datetime.utcnow()
         })
-        recalculate_holding(user_id, symbol)
+        apply_holding_delta(user_id, symbol, quantity, quantity * price)
         flash(f"Added {symbol}. Click 'Refresh Prices' to fetch its latest data.", "info")
 
     except (ValueError, TypeError):
@@ -148,11 +349,17 @@ def edit_transaction_route(transaction_id):
                 flash("Quantity and price must be positive values.", "danger")
                 return render_template('edit_transaction.html', transaction=transaction)
 
-            db.transactions.update_one(
-                {'_id': ObjectId(transaction_id)},
+            # find_one_and_update returns the pre-update document, so the delta is exact even under concurrent edits
+            previous = db.transactions.find_one_and_update(
+                {'_id': ObjectId(transaction_id), 'user_id': user_id},
                 {'$set': {'quantity': quantity, 'price': price}}
             )
-            recalculate_holding(user_id, transaction['symbol'])
+            if previous:
+                apply_holding_delta(
+                    user_id, previous['symbol'],
+                    quantity - previous['quantity'],
+                    quantity * price - previous['quantity'] * previous['price']
+                )
             flash("Transaction updated successfully.", "success")
             return redirect(url_for('main.list_transactions'))
 
@@ -169,87 +376,93 @@ def edit_transaction_route(transaction_id):
 @login_required
 def delete_transaction_route(transaction_id):
     user_id = ObjectId(current_user.id)
-    t = db.transactions.find_one({'_id': ObjectId(transaction_id), 'user_id': user_id})
+    # Atomic find-and-delete, so a double submit cannot subtract the same trade twice
+    t = db.transactions.find_one_and_delete({'_id': ObjectId(transaction_id), 'user_id': user_id})
     if t:
-        db.transactions.delete_one({'_id': ObjectId(transaction_id)})
-        recalculate_holding(user_id, t['symbol'])
+        apply_holding_delta(user_id, t['symbol'], -t['quantity'], -t['quantity'] * t['price'])
         flash("Transaction deleted successfully.", "info")
     return redirect(url_for('main.list_transactions'))
 
+def finish_import(user_id):
+    """Runs after a background CSV import: one aggregation + bulk write rebuilds every holding."""
+    rebuild_holdings(user_id)
+    invalidate_dashboard(db, user_id)
+
 @bp.route('/upload_csv', methods=['POST'])
 @login_required
 def upload_csv_route():
+    """Saves the upload and queues a background import; JSON callers get the job to poll."""
+    wants_json = request.accept_mimetypes.best == 'application/json'
     user_id = ObjectId(current_user.id)
     f = request.files.get('csv_file')
     
     if not f:
+        if wants_json:
+            return jsonify({'error': "No file uploaded."}), 400
         flash("No file uploaded.", "danger")
         return redirect(url_for('main.index'))
 
     try:
-        db.holdings.delete_many({'user_id': user_id})
-        db.transactions.delete_many({'user_id': user_id})
-        
-        stream = io.StringIO(f.stream.read().decode("UTF-8"), newline=None)
-        reader = csv.DictReader(stream)
-        
-        transactions_to_insert = []
-        for row in reader:
-            symbol = row.get('Symbol', '').strip().upper()
-            if not symbol:
-                continue # Skip rows without a symbol
-
-            try:
-                quantity = float(row['Quantity'])
-                price = float(row['Price'])
-
-                if quantity <= 0 or price <= 0:
-                    flash(f"Skipping row for {symbol}: Quantity and price must be positive.", "warning")
-                    continue
-
-                transactions_to_insert.append({
-                    'user_id': user_id,
-                    'symbol': symbol,
-                    'quantity': quantity,
-                    'price': price,
-                    'date': datetime.utcnow() # Using current time for all imported transactions
-                })
-            except (ValueError, TypeError):
-                flash(f"Skipping row for {symbol}: Invalid quantity or price format.", "warning")
-            except KeyError as e:
-                flash(f"Skipping row for {symbol}: Missing expected column - {e}.", "warning")
-
-        if transactions_to_insert:
-            db.transactions.insert_many(transactions_to_insert)
-            # Recalculate holdings for all unique symbols imported
-            for sym in {t['symbol'] for t in transactions_to_insert}:
-                recalculate_holding(user_id, sym)
-            flash(f"Successfully imported {len(transactions_to_insert)} transactions. Click 'Refresh Prices' to fetch the latest data.", "success")
-        else:
-            flash("No valid transactions found in the CSV file.", "info")
-
-    except UnicodeDecodeError:
-        flash("Error decoding file. Please ensure the CSV is UTF-8 encoded.", "danger")
-    except csv.Error as e:
-        flash(f"Error parsing CSV file: {e}", "danger")
-    except Exception as e:
-        flash(f"An unexpected error occurred during CSV import: {e}", "danger")
+        job = start_import(user_id, f, finish_import)
+    except ImportInProgress as e:
+        if wants_json:
+            return jsonify({'error': str(e)}), 409
+        flash(str(e), "warning")
+        return redirect(url_for('main.index'))
 
+    if wants_json:
+        return jsonify(import_status(job)), 202
+    flash("Your CSV import has started. Reload the page in a moment to see the imported data.", "info")
     return redirect(url_for('main.index'))
 
+@bp.route('/import_jobs/<job_id>')
+@login_required
+def import_status_route(job_id):
+    """JSON progress of one of the user's CSV imports, polled by the import modal."""
+    job = db.import_jobs.find_one({'_id': job_id, 'user_id': ObjectId(current_user.id)})
+    if job is None:
+        return jsonify({'error': 'Unknown import job.'}), 404
+    return jsonify(import_status(job))
+
+
+# Rows buffered per chunk of the streamed CSV export
+EXPORT_BATCH_SIZE = 1000
+
+def iter_transactions_csv(cursor):
+    """Yields the CSV export in chunks of EXPORT_BATCH_SIZE rows, so memory stays flat."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(['Symbol', 'Quantity', 'Price', 'Date'])
+    for count, t in enumerate(cursor, 1):
+        writer.writerow([t['symbol'], t['quantity'], t['price'], t['date'].strftime('%Y-%m-%d %H:%M:%S')])
+        if count % EXPORT_BATCH_SIZE == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate(0)
+    yield buf.getvalue()
+
+def gzip_chunks(chunks):
+    """Gzips a stream of text chunks on the fly."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)  # | 16 selects the gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
 
 @bp.route('/export_csv')
 @login_required
 def export_csv_route():
     user_id = ObjectId(current_user.id)
-    out = io.StringIO()
-    writer = csv.DictWriter(out, fieldnames=['Symbol', 'Quantity', 'Price', 'Date'])
-    writer.writeheader()
-    for t in db.transactions.find({'user_id': user_id}, {'_id': 0, 'user_id': 0}):
-        t['Date'] = t.pop('date').strftime('%Y-%m-%d %H:%M:%S')
-        t['Symbol'] = t.pop('symbol'); t['Quantity'] = t.pop('quantity'); t['Price'] = t.pop('price')
-        writer.writerow(t)
-    return Response(out.getvalue(), mimetype="text/csv", headers={"Content-Disposition": "attachment;filename=transactions.csv"})
+    cursor = db.transactions.find(
+        {'user_id': user_id},
+        {'_id': 0, 'symbol': 1, 'quantity': 1, 'price': 1, 'date': 1},
+        batch_size=EXPORT_BATCH_SIZE
+    )
+    chunks = iter_transactions_csv(cursor)
+    if request.args.get('gzip') == '1':
+        return Response(gzip_chunks(chunks), mimetype="application/gzip", headers={"Content-Disposition": "attachment;filename=transactions.csv.gz"})
+    return Response(chunks, mimetype="text/csv", headers={"Content-Disposition": "attachment;filename=transactions.csv"})
 
 @bp.route('/delete_all', methods=['POST'])
 @login_required
@@ -257,6 +470,7 @@ def delete_all_route():
     user_id = ObjectId(current_user.id)
     db.holdings.delete_many({'user_id': user_id})
     db.transactions.delete_many({'user_id': user_id})
+    invalidate_dashboard(db, user_id)
     flash("Portfolio cleared", "info")
     return redirect(url_for('main.index'))
 
@@ -280,9 +494,8 @@ def bulk_edit_symbol_route():
             )
 
             if result.modified_count > 0:
-                # Recalculate holdings for both old and new symbols
-                recalculate_holding(user_id, old_symbol)
-                recalculate_holding(user_id, new_symbol)
+                # Recalculate holdings for both old and new symbols in one pass
+                rebuild_holdings(user_id, symbols=[old_symbol, new_symbol])
                 flash(f"Updated {result.modified_count} transactions from {old_symbol} to {new_symbol}.", "success")
             else:
                 flash(f"No transactions found for symbol {old_symbol}.", "info")
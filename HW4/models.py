@@ -1,19 +1,74 @@
 # models.py
-from flask_login import UserMixin
+import os
+import threading
+import time
 from bson.objectid import ObjectId
+from bson.errors import InvalidId
 from extensions import db
 
-class User(UserMixin):
-    """User model for authentication."""
+# Loaded users are reused for this many seconds per worker. Entries are only
+# dropped early by the process holding them (on logout), so a role change
+# reaches running workers once their entries expire
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", 60))
+USER_CACHE_SIZE = 10000
+# The password hash is only needed at login and never goes into the cache
+USER_PROJECTION = {'username': 1, 'role': 1}
+
+_user_cache = {}
+_user_cache_lock = threading.Lock()
+
+class User:
+    """User model for authentication: a slim record without the password hash."""
+    __slots__ = ('id', 'username', 'role')
+
+    # Flask-Login's user interface (what UserMixin would provide)
+    is_authenticated = True
+    is_active = True
+    is_anonymous = False
+
     def __init__(self, user_data):
         self.id = str(user_data["_id"])
         self.username = user_data["username"]
-        self.password_hash = user_data["password_hash"]
         self.role = user_data.get("role", "user")
 
+    def get_id(self):
+        return self.id
+
+    def __eq__(self, other):
+        return isinstance(other, User) and self.id == other.id
+
+    __hash__ = object.__hash__
+
 def load_user(user_id):
-    """Loads a user from the database for Flask-Login."""
-    if db is not None:
-        user_data = db.users.find_one({"_id": ObjectId(user_id)})
-        return User(user_data) if user_data else None
-    return None
\ No newline at end of file
+    """Loads a user for Flask-Login, from the per-worker cache when possible."""
+    now = time.monotonic()
+    with _user_cache_lock:
+        cached = _user_cache.get(user_id)
+    if cached and cached[0] > now:
+        return cached[1]
+
+    try:
+        user_data = db.users.find_one({"_id": ObjectId(user_id)}, USER_PROJECTION)
+    except InvalidId:
+        # A malformed id in an old session cookie just means "not logged in"
+        return None
+    if not user_data:
+        return None
+
+    user = User(user_data)
+    with _user_cache_lock:
+        if len(_user_cache) >= USER_CACHE_SIZE:
+            for key in [k for k, (expires, _) in _user_cache.items() if expires <= now] or [next(iter(_user_cache))]:
+                del _user_cache[key]
+        _user_cache[user_id] = (now + USER_CACHE_TTL, user)
+    return user
+
+def invalidate_user(user_id):
+    """Drops a user from this process's cache; other workers keep theirs until USER_CACHE_TTL."""
+    with _user_cache_lock:
+        _user_cache.pop(str(user_id), None)
+
+def set_user_role(user_id, role):
+    """Changes a user's role; web workers pick it up within USER_CACHE_TTL seconds."""
+    result = db.users.update_one({"_id": ObjectId(user_id)}, {"$set": {"role": role}})
+    return result.matched_count == 1
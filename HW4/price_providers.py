@@ -0,0 +1,280 @@
+# price_providers.py
+"""Price providers used by update_prices.py.
+
+Every provider answers fetch_quotes(symbols) with
+{symbol: {'current_price': ..., 'previous_close': ...}} for the symbols it
+could price (and optionally fetch_names(symbols) with {symbol: name}), and
+keeps call/latency/error counters. update_stock_prices asks the providers in
+order, each one only for the symbols still missing.
+
+yfinance and pandas are imported by the YFinanceProvider methods that use
+them, so replay runs and Finnhub-only setups never load them.
+
+ReplayProvider serves quotes recorded to a JSON file, which makes refreshes
+reproducible offline (see bench_update_prices.py). Set PRICE_PROVIDER=replay
+and PRICE_REPLAY_FILE to use it instead of the live providers, or
+PRICE_RECORD_FILE to record what the live providers return.
+"""
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+FINNHUB_API_KEY = os.getenv("FINNHUB_API_KEY")
+
+# yfinance batch downloads: symbols per yf.download call, and the download threads yfinance uses inside each call
+YF_CHUNK_SIZE = int(os.getenv("YF_CHUNK_SIZE", 200))
+YF_THREADS = int(os.getenv("YF_THREADS", 8))
+NAME_LOOKUP_WORKERS = 8
+
+# Finnhub fallback: the free plan allows 60 calls/minute. The base URL can be
+# pointed at a local stub server for testing (see bench_finnhub.py).
+FINNHUB_BASE_URL = os.getenv("FINNHUB_BASE_URL", "https://finnhub.io/api/v1")
+FINNHUB_CALLS_PER_MINUTE = int(os.getenv("FINNHUB_CALLS_PER_MINUTE", 60))
+FINNHUB_BURST = int(os.getenv("FINNHUB_BURST", 10))
+FINNHUB_WORKERS = int(os.getenv("FINNHUB_WORKERS", 4))
+FINNHUB_TIMEOUT = float(os.getenv("FINNHUB_TIMEOUT", 5))
+FINNHUB_MAX_RETRIES = 3
+# Longest a worker thread will sleep on a server-supplied Retry-After
+FINNHUB_MAX_BACKOFF = float(os.getenv("FINNHUB_MAX_BACKOFF", 30))
+
+
+class PriceProvider:
+    """Base class: subclasses implement _fetch_quotes (and optionally _fetch_names)."""
+    name = 'provider'
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.symbols_requested = 0
+        self.quotes_returned = 0
+        self.latency = 0.0
+
+    def fetch_quotes(self, symbols):
+        """Returns quotes for the symbols this provider could price; never raises."""
+        if not symbols:
+            return {}
+        started = time.perf_counter()
+        self.calls += 1
+        self.symbols_requested += len(symbols)
+        try:
+            quotes = self._fetch_quotes(list(symbols))
+        except Exception as e:
+            print(f"{self.name} failed: {e}")
+            self.errors += 1
+            quotes = {}
+        self.latency += time.perf_counter() - started
+        self.quotes_returned += len(quotes)
+        return quotes
+
+    def fetch_names(self, symbols):
+        """Returns company names for the symbols this provider knows; none by default."""
+        return self._fetch_names(list(symbols)) if symbols else {}
+
+    def _fetch_quotes(self, symbols):
+        raise NotImplementedError
+
+    def _fetch_names(self, symbols):
+        return {}
+
+    def stats(self):
+        return {
+            'provider': self.name,
+            'calls': self.calls,
+            'errors': self.errors,
+            'symbols_requested': self.symbols_requested,
+            'quotes_returned': self.quotes_returned,
+            'hit_rate': self.quotes_returned / self.symbols_requested if self.symbols_requested else 0.0,
+            'latency_s': round(self.latency, 3),
+        }
+
+
+def extract_last_quotes(data, symbols):
+    """Takes the latest close/open for every symbol of a yf.download frame at once.
+
+    Forward-filling first means a symbol whose market has no row for the most
+    recent date (e.g. .TW next to US tickers) still gets its last quote.
+    """
+    import pandas as pd
+
+    if data is None or data.empty:
+        return {}
+    if isinstance(data.columns, pd.MultiIndex):
+        close, open_ = data['Close'], data['Open']
+    else:
+        # A single-ticker download has flat columns
+        close, open_ = data[['Close']].set_axis(symbols[:1], axis=1), data[['Open']].set_axis(symbols[:1], axis=1)
+    last = pd.DataFrame({
+        'current_price': close.ffill().iloc[-1],
+        'previous_close': open_.ffill().iloc[-1]
+    }).dropna()
+    last = last[(last > 0).all(axis=1)]
+    return last.astype(float).to_dict('index')
+
+
+class YFinanceProvider(PriceProvider):
+    """Primary provider: batched yf.download calls, names from Ticker.info."""
+    name = 'yfinance'
+
+    def __init__(self, session):
+        super().__init__()
+        self.session = session
+
+    def _fetch_quotes(self, symbols):
+        import yfinance as yf
+
+        print(f"Attempting to fetch {len(symbols)} symbols from yfinance...")
+        results = {}
+        # yf.download keeps its results in module-level state, so chunks are downloaded one after
+        # another and parallelism comes from yfinance's own per-ticker threads within each chunk
+        for start in range(0, len(symbols), YF_CHUNK_SIZE):
+            chunk = symbols[start:start + YF_CHUNK_SIZE]
+            try:
+                data = yf.download(tickers=chunk, period='1d', progress=False, session=self.session, threads=YF_THREADS)
+                results.update(extract_last_quotes(data, chunk))
+            except Exception as e:
+                # One bad chunk only loses its own symbols; they fall through to the next provider
+                print(f"Yfinance download failed for a chunk of {len(chunk)} symbols: {e}")
+                self.errors += 1
+        return results
+
+    def _fetch_names(self, symbols):
+        """Looks up longName for each symbol concurrently; failed lookups are left out."""
+        import yfinance as yf
+
+        def lookup(symbol):
+            try:
+                return symbol, yf.Ticker(symbol, session=self.session).info.get('longName', symbol)
+            except Exception as e:
+                print(f"Name lookup failed for {symbol}: {e}")
+                return symbol, None
+
+        with ThreadPoolExecutor(max_workers=min(NAME_LOOKUP_WORKERS, len(symbols))) as executor:
+            return {symbol: name for symbol, name in executor.map(lookup, symbols) if name}
+
+
+class TokenBucket:
+    """Thread-safe token bucket: allows `rate` calls per second with bursts of up to `capacity`."""
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is available, then takes it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class FinnhubProvider(PriceProvider):
+    """Fallback provider, run as fast as the Finnhub rate limit allows."""
+    name = 'finnhub'
+
+    def __init__(self, session):
+        super().__init__()
+        self.session = session
+        # _fetch_quote runs on FINNHUB_WORKERS threads at once
+        self._errors_lock = threading.Lock()
+
+    def _count_error(self):
+        with self._errors_lock:
+            self.errors += 1
+
+    def _fetch_quote(self, symbol, limiter):
+        """Fetches one quote, retrying throttled/failed calls with jittered exponential backoff."""
+        for attempt in range(FINNHUB_MAX_RETRIES + 1):
+            limiter.acquire()
+            try:
+                res = self.session.get(f"{FINNHUB_BASE_URL}/quote", params={'symbol': symbol, 'token': FINNHUB_API_KEY}, timeout=FINNHUB_TIMEOUT)
+                if res.status_code == 429 or res.status_code >= 500:
+                    raise requests.HTTPError(f"{res.status_code} from Finnhub", response=res)
+                res.raise_for_status()
+                data = res.json()
+                if data.get('c', 0) > 0:
+                    return {'current_price': data['c'], 'previous_close': data['pc']}
+                return None
+            except (ValueError, KeyError) as e:
+                # Checked first: requests' JSONDecodeError is a RequestException too, but retrying won't fix the body
+                print(f"Finnhub returned invalid data for {symbol}: {e}")
+                self._count_error()
+                return None
+            except requests.RequestException as e:
+                response = getattr(e, 'response', None)
+                retryable = response is None or response.status_code == 429 or response.status_code >= 500
+                if not retryable or attempt == FINNHUB_MAX_RETRIES:
+                    # Don't print the exception itself: its URL carries the API token
+                    reason = f"HTTP {response.status_code}" if response is not None else type(e).__name__
+                    print(f"Finnhub failed for {symbol}: {reason}")
+                    self._count_error()
+                    return None
+                retry_after = response.headers.get('Retry-After') if response is not None else None
+                backoff = float(retry_after) if retry_after and retry_after.isdigit() else 2 ** attempt
+                time.sleep(min(backoff, FINNHUB_MAX_BACKOFF) * random.uniform(0.5, 1.0))
+
+    def _fetch_quotes(self, symbols):
+        if not FINNHUB_API_KEY:
+            return {}
+
+        print(f"Attempting Finnhub fallback for {len(symbols)} symbols...")
+        limiter = TokenBucket(FINNHUB_CALLS_PER_MINUTE / 60, FINNHUB_BURST)
+        # Keep one pooled connection per worker so calls reuse TCP/TLS sessions
+        self.session.mount(FINNHUB_BASE_URL, HTTPAdapter(pool_connections=1, pool_maxsize=FINNHUB_WORKERS))
+        with ThreadPoolExecutor(max_workers=FINNHUB_WORKERS) as executor:
+            quotes = executor.map(lambda symbol: self._fetch_quote(symbol, limiter), symbols)
+            return {symbol: quote for symbol, quote in zip(symbols, quotes) if quote}
+
+
+class ReplayProvider(PriceProvider):
+    """Serves quotes (and names) recorded in a JSON file: {symbol: {current_price, previous_close, name}}."""
+    name = 'replay'
+
+    def __init__(self, path):
+        super().__init__()
+        with open(path, encoding='utf-8') as f:
+            self.recorded = json.load(f)
+
+    def _fetch_quotes(self, symbols):
+        return {
+            symbol: {'current_price': quote['current_price'], 'previous_close': quote['previous_close']}
+            for symbol, quote in ((s, self.recorded.get(s)) for s in symbols) if quote
+        }
+
+    def _fetch_names(self, symbols):
+        return {s: self.recorded[s]['name'] for s in symbols if self.recorded.get(s, {}).get('name')}
+
+
+def record_quotes(path, quotes, names=None):
+    """Merges quotes (and names) into a replay file for ReplayProvider."""
+    recorded = {}
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            recorded = json.load(f)
+    for symbol, quote in quotes.items():
+        entry = recorded.setdefault(symbol, {})
+        entry.update({'current_price': float(quote['current_price']), 'previous_close': float(quote['previous_close'])})
+        if names and symbol in names:
+            entry['name'] = names[symbol]
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(recorded, f, indent=1, sort_keys=True)
+
+
+def default_providers(session):
+    """The providers update_stock_prices uses unless told otherwise."""
+    if os.getenv("PRICE_PROVIDER") == 'replay':
+        return [ReplayProvider(os.environ["PRICE_REPLAY_FILE"])]
+    return [YFinanceProvider(session), FinnhubProvider(session)]
@@ -0,0 +1,131 @@
+# refresh_jobs.py
+"""Background price refreshes requested from the dashboard.
+
+A refresh job is a document in `refresh_jobs`:
+
+    {_id: job_id, status, active, requested_by, created_at, started_at, finished_at, error, timings}
+
+status goes queued -> running -> succeeded / failed / skipped. Only one job
+can be `active` at a time (unique partial index in indexes.py), so clicks that
+arrive while a refresh is queued or running join that job instead of starting
+another. Job documents live in Mongo rather than in process memory so that any
+gunicorn worker can answer the status poll.
+
+When the price daemon (update_prices.py --daemon) is deployed, set
+PRICE_UPDATER_DAEMON=1 for the web service: jobs are then only queued here and
+the daemon runs them, so no refresh ever runs inside a web worker.
+"""
+import os
+import uuid
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from background import LazyExecutor
+from extensions import db
+from lease_lock import LeaseLock, PRICE_REFRESH_LOCK
+from refresh_planner import plan_refresh
+from update_prices import update_stock_prices
+
+# Minimum time between two refresh requests from the same user
+REFRESH_THROTTLE = timedelta(minutes=5)
+# An active job older than this belonged to a worker that died; it no longer blocks new jobs
+JOB_TIMEOUT = timedelta(minutes=15)
+# Queued jobs are left for the price daemon instead of running in this process
+PRICE_UPDATER_DAEMON = os.getenv("PRICE_UPDATER_DAEMON", "").lower() in ("1", "true", "yes")
+
+_executor = LazyExecutor(max_workers=1, thread_name_prefix='price-refresh')
+
+
+def claim_refresh_slot(user_id):
+    """Records a refresh request for the user; returns seconds to wait if they asked too recently, else 0."""
+    now = datetime.utcnow()
+    result = db.users.update_one(
+        {'_id': user_id, 'last_refresh_requested': {'$not': {'$gt': now - REFRESH_THROTTLE}}},
+        {'$set': {'last_refresh_requested': now}}
+    )
+    if result.matched_count:
+        return 0
+    user = db.users.find_one({'_id': user_id}, {'last_refresh_requested': 1})
+    last = (user or {}).get('last_refresh_requested', now)
+    return max(1, int((last + REFRESH_THROTTLE - now).total_seconds()))
+
+
+def enqueue_refresh(user_id):
+    """Returns (job, coalesced): the active refresh job, started by this call unless one was already pending."""
+    now = datetime.utcnow()
+    db.refresh_jobs.update_many(
+        {'active': True, 'created_at': {'$lt': now - JOB_TIMEOUT}},
+        {'$set': {'status': 'failed', 'error': 'The refresh was abandoned.', 'finished_at': now}, '$unset': {'active': ''}}
+    )
+
+    job_id = uuid.uuid4().hex
+    for _ in range(2):
+        try:
+            job = db.refresh_jobs.find_one_and_update(
+                {'active': True},
+                {'$setOnInsert': {'_id': job_id, 'status': 'queued', 'created_at': now}, '$addToSet': {'requested_by': user_id}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            break
+        except DuplicateKeyError:
+            # Another worker inserted the active job between our match and insert; join it on the retry
+            continue
+    else:
+        job = db.refresh_jobs.find_one({'active': True})
+
+    coalesced = job['_id'] != job_id
+    if not coalesced and not PRICE_UPDATER_DAEMON:
+        _executor.submit(run_refresh_job, job_id)
+    return job, coalesced
+
+
+def next_queued_job():
+    """Returns the id of the queued refresh job, if there is one (the daemon polls this)."""
+    job = db.refresh_jobs.find_one({'active': True, 'status': 'queued'}, {'_id': 1})
+    return job['_id'] if job else None
+
+
+def run_refresh_job(job_id):
+    """Runs a queued job; returns the fields written to it, or None if another process started it first."""
+    started = db.refresh_jobs.update_one(
+        {'_id': job_id, 'status': 'queued'},
+        {'$set': {'status': 'running', 'started_at': datetime.utcnow()}}
+    )
+    if not started.matched_count:
+        return None
+    result = {'status': 'succeeded'}
+    try:
+        with LeaseLock(db.locks, PRICE_REFRESH_LOCK) as lock:
+            if not lock.acquired:
+                result = {'status': 'skipped', 'error': 'Prices were already being refreshed by another worker.'}
+            else:
+                print(f"--- [Refresh job {job_id}] Running Price Update ---")
+                plan = plan_refresh(db)
+                if plan['due']:
+                    timings = update_stock_prices(symbols=plan['due'])
+                    if timings:
+                        result['timings'] = {k: round(v, 3) for k, v in timings.items() if isinstance(v, float)}
+                    else:
+                        result = {'status': 'failed', 'error': 'No prices could be fetched. Please try again later.'}
+    except Exception as e:
+        print(f"Refresh job {job_id} failed: {e}")
+        result = {'status': 'failed', 'error': str(e)}
+    result['finished_at'] = datetime.utcnow()
+    db.refresh_jobs.update_one({'_id': job_id}, {'$set': result, '$unset': {'active': ''}})
+    return result
+
+
+def job_status(job):
+    """The JSON view of a job document."""
+    return {
+        'job_id': job['_id'],
+        'status': job['status'],
+        'done': job['status'] in ('succeeded', 'failed', 'skipped'),
+        'error': job.get('error'),
+        'created_at': job['created_at'].isoformat(),
+        'finished_at': job['finished_at'].isoformat() if job.get('finished_at') else None,
+        'timings': job.get('timings'),
+    }
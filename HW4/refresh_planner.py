@@ -0,0 +1,136 @@
+# refresh_planner.py
+"""Decides which held symbols a price refresh actually needs to fetch.
+
+A symbol's market comes from its ticker suffix (2330.TW -> Taiwan, no suffix
+-> US). A symbol is due when it has no price yet, when its market is open and
+its price is older than that market's freshness threshold, or when its market
+is closed but the price predates the last close (so the closing quote is
+picked up once). Everything else is left alone until its market reopens.
+
+Due symbols are ordered by how many users hold them, so a capped run
+(PRICE_REFRESH_MAX_SYMBOLS) spends its API calls where they matter most.
+Market hours are plain weekday sessions; exchange holidays are not modelled,
+so on a holiday the market's symbols are refreshed as if it were trading.
+
+A market's freshness threshold is also how often the price daemon
+(update_prices.py --daemon) refreshes it while it is open. Override it per
+market with PRICE_CADENCE, in minutes by market name: "US=5,TWSE=10".
+"""
+import os
+from collections import namedtuple
+from datetime import datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+Market = namedtuple('Market', 'name tz opens closes freshness')
+
+
+def _parse_cadence(setting):
+    """Parses "US=5,TWSE=10" into {market name: timedelta}."""
+    cadence = {}
+    for item in filter(None, (part.strip() for part in setting.split(','))):
+        name, _, minutes = item.rpartition('=')
+        cadence[name.strip()] = timedelta(minutes=float(minutes))
+    return cadence
+
+PRICE_CADENCE = _parse_cadence(os.getenv("PRICE_CADENCE", ""))
+DEFAULT_FRESHNESS = timedelta(minutes=15)
+
+def _market(name, tz, opens, closes):
+    return Market(name, ZoneInfo(tz), opens, closes, PRICE_CADENCE.get(name, DEFAULT_FRESHNESS))
+
+US_MARKET = _market('US', 'America/New_York', time(9, 30), time(16, 0))
+# Longest suffix first, so .TWO is not mistaken for .TW
+MARKETS = {
+    '.TWO': _market('Taipei Exchange', 'Asia/Taipei', time(9, 0), time(13, 30)),
+    '.TW': _market('TWSE', 'Asia/Taipei', time(9, 0), time(13, 30)),
+    '.HK': _market('HKEX', 'Asia/Hong_Kong', time(9, 30), time(16, 0)),
+    '.T': _market('Tokyo', 'Asia/Tokyo', time(9, 0), time(15, 30)),
+    '.L': _market('London', 'Europe/London', time(8, 0), time(16, 30)),
+}
+ALL_MARKETS = [US_MARKET, *MARKETS.values()]
+
+_unknown = set(PRICE_CADENCE) - {market.name for market in ALL_MARKETS}
+if _unknown:
+    raise ValueError(f"PRICE_CADENCE names unknown markets: {', '.join(sorted(_unknown))}")
+
+# Quotes settle a little after the bell; a price fetched before close + this may not be the closing one
+CLOSE_SETTLE = timedelta(minutes=20)
+
+PRICE_REFRESH_MAX_SYMBOLS = int(os.getenv("PRICE_REFRESH_MAX_SYMBOLS", 0)) or None
+
+
+def market_for(symbol):
+    for suffix, market in MARKETS.items():
+        if symbol.upper().endswith(suffix):
+            return market
+    return US_MARKET
+
+
+def market_state(market, now):
+    """Returns (is_open, last_close) for a naive-UTC `now`; last_close is naive UTC too."""
+    local = now.replace(tzinfo=timezone.utc).astimezone(market.tz)
+    is_open = local.weekday() < 5 and market.opens <= local.time() < market.closes
+
+    day = local.date()
+    if local.time() < market.closes:
+        day -= timedelta(days=1)
+    while day.weekday() >= 5:
+        day -= timedelta(days=1)
+    last_close = datetime.combine(day, market.closes, market.tz).astimezone(timezone.utc).replace(tzinfo=None)
+    return is_open, last_close
+
+
+def next_open(market, now):
+    """Returns when the market next opens after a naive-UTC `now`, as naive UTC."""
+    local = now.replace(tzinfo=timezone.utc).astimezone(market.tz)
+    day = local.date()
+    while True:
+        opens = datetime.combine(day, market.opens, market.tz)
+        if day.weekday() < 5 and opens > local:
+            return opens.astimezone(timezone.utc).replace(tzinfo=None)
+        day += timedelta(days=1)
+
+
+def plan_refresh(database, now=None, max_symbols=PRICE_REFRESH_MAX_SYMBOLS, markets=None):
+    """Returns {'due': [symbols, most-held first], 'fresh': n, 'closed': n, 'deferred': n}.
+
+    With markets (a collection of Market), symbols of other markets are left out entirely.
+    """
+    now = now or datetime.utcnow()
+    holders = {
+        row['_id']: row['holders']
+        for row in database.holdings.aggregate([{'$group': {'_id': '$symbol', 'holders': {'$sum': 1}}}])
+    }
+    last_updated = {
+        p['symbol']: p.get('last_updated')
+        for p in database.prices.find({'symbol': {'$in': list(holders)}}, {'symbol': 1, 'last_updated': 1})
+    }
+
+    states = {}
+    plan = {'due': [], 'fresh': 0, 'closed': 0, 'deferred': 0}
+    for symbol in holders:
+        market = market_for(symbol)
+        if markets is not None and market not in markets:
+            continue
+        updated = last_updated.get(symbol)
+        if market not in states:
+            states[market] = market_state(market, now)
+        is_open, last_close = states[market]
+
+        if updated is None:
+            plan['due'].append(symbol)
+        elif is_open:
+            if updated <= now - market.freshness:
+                plan['due'].append(symbol)
+            else:
+                plan['fresh'] += 1
+        elif updated < last_close + CLOSE_SETTLE and now >= last_close + CLOSE_SETTLE:
+            plan['due'].append(symbol)
+        else:
+            plan['closed'] += 1
+
+    plan['due'].sort(key=lambda s: (-holders[s], s))
+    if max_symbols and len(plan['due']) > max_symbols:
+        plan['deferred'] = len(plan['due']) - max_symbols
+        plan['due'] = plan['due'][:max_symbols]
+    return plan
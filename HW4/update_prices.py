@@ -1,127 +1,252 @@
 # update_prices.py
-import yfinance as yf
-import requests
-from pymongo import MongoClient, UpdateOne
-from dotenv import load_dotenv
+"""Fetches stock prices into the prices collection.
+
+`python update_prices.py` runs one refresh. `python update_prices.py --daemon`
+is the long-running price updater, deployed as its own process so that the
+fetching stack (yfinance, pandas) and its CPU spikes stay out of the web
+workers. It refreshes each market on its own cadence (refresh_planner,
+PRICE_CADENCE), runs the refreshes users request from the dashboard (with
+PRICE_UPDATER_DAEMON=1 on the web service), stops cleanly on SIGTERM/SIGINT
+after the run in progress, and reports every run as one JSON line on stdout
+that is also kept in `price_update_runs` for a week.
+"""
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+import argparse
+import json
 import os
+import signal
+import threading
 import time
-from datetime import datetime
-import pandas as pd
-
-load_dotenv()
-MONGO_URI = os.getenv("MONGO_URI")
-FINNHUB_API_KEY = os.getenv("FINNHUB_API_KEY")
-
-try:
-    client = MongoClient(MONGO_URI)
-    db = client.stock_portfolio_db
-    prices_collection = db.prices
-    holdings_collection = db.holdings
-except Exception as e:
-    print(f"Price updater could not connect to MongoDB: {e}")
-    db = None
-
-def fetch_from_yfinance(symbols, session):
-    """Primary fetch function using yfinance."""
-    print(f"Attempting to fetch {len(symbols)} symbols from yfinance...")
-    try:
-        data = yf.download(tickers=symbols, period='1d', progress=False, session=session)
-        if data.empty:
-            return {}
-        
-        results = {}
-        for symbol in symbols:
-            price, prev_close = (None, None)
-            if len(symbols) == 1 and not data.empty:
-                last_row = data.iloc[-1]
-                price = last_row['Close']
-                prev_close = last_row['Open']
-            elif symbol in data['Close'] and not pd.isna(data['Close'][symbol].iloc[-1]):
-                price = data['Close'][symbol].iloc[-1]
-                prev_close = data['Open'][symbol].iloc[-1]
-            
-            if price and prev_close:
-                results[symbol] = {'current_price': price, 'previous_close': prev_close}
-        return results
-    except Exception as e:
-        print(f"Yfinance download failed: {e}")
-        return {}
-
-def fetch_from_finnhub(symbols, session):
-    """Fallback fetch function using Finnhub."""
-    if not FINNHUB_API_KEY:
-        return {}
-    
-    print(f"Attempting Finnhub fallback for {len(symbols)} symbols...")
-    results = {}
-    for symbol in symbols:
-        try:
-            quote_url = f"https://finnhub.io/api/v1/quote?symbol={symbol}&token={FINNHUB_API_KEY}"
-            res = session.get(quote_url, timeout=5)
-            res.raise_for_status()
-            data = res.json()
-            if data.get('c', 0) > 0:
-                results[symbol] = {'current_price': data['c'], 'previous_close': data['pc']}
-            time.sleep(1)
-        except Exception as e:
-            print(f"Finnhub failed for {symbol}: {e}")
-    return results
-
-def update_stock_prices():
-    """Main function to fetch and update all unique stock prices in the database."""
-    if db is None:
-        print("No database connection. Aborting price update.")
-        return
+from datetime import datetime, timedelta
+
+from extensions import get_db
+from indexes import ensure_indexes
+from lease_lock import LeaseLock, PRICE_REFRESH_LOCK
+from refresh_planner import ALL_MARKETS, market_state, next_open, plan_refresh
+from dashboard_cache import bump_prices_version
+
+# When set, every live refresh also writes its quotes/names here for ReplayProvider
+PRICE_RECORD_FILE = os.getenv("PRICE_RECORD_FILE")
+
+# Company names rarely change, so they are cached on the prices doc and only refetched after this long
+NAME_TTL = timedelta(days=30)
+
+# How often the daemon checks for requested refreshes (and for a stop signal)
+DAEMON_POLL_SECONDS = float(os.getenv("PRICE_DAEMON_POLL_SECONDS", 5))
+# How often a closed market is looked at, to pick up its closing quotes and newly added symbols
+CLOSED_MARKET_CADENCE = timedelta(minutes=float(os.getenv("PRICE_CLOSED_CADENCE_MINUTES", 30)))
+# A run that failed is retried after this
+RETRY_AFTER = timedelta(minutes=1)
+
+def update_stock_prices(providers=None, database=None, force=False, symbols=None):
+    """Main function to fetch and update the stale stock prices in the database.
+
+    Only the symbols refresh_planner.plan_refresh marks as due are fetched,
+    unless force is set or the symbols to fetch are given. providers are asked
+    in order, each for the symbols the earlier ones could not price; database
+    defaults to stock_portfolio_db.
+    """
+    database = database if database is not None else get_db()
+    prices_collection, holdings_collection = database.prices, database.holdings
 
     try:
-        unique_symbols = holdings_collection.distinct("symbol")
+        if symbols is not None:
+            unique_symbols = list(symbols)
+        elif force:
+            unique_symbols = holdings_collection.distinct("symbol")
+        else:
+            plan = plan_refresh(database)
+            unique_symbols = plan['due']
+            print(f"Refresh plan: {len(unique_symbols)} due, {plan['fresh']} fresh, "
+                  f"{plan['closed']} in closed markets, {plan['deferred']} deferred")
         if not unique_symbols:
-            print("No holdings found. Nothing to update.")
+            print("No stale prices. Nothing to update.")
             return
     except Exception as e:
-        print(f"Error fetching unique symbols: {e}")
+        print(f"Error planning the price update: {e}")
         return
 
-    print(f"Found {len(unique_symbols)} unique symbols to update: {', '.join(unique_symbols)}")
+    print(f"Updating {len(unique_symbols)} symbols: {', '.join(unique_symbols[:20])}{' ...' if len(unique_symbols) > 20 else ''}")
+
+    timings = {}
+    started = time.perf_counter()
+    # requests, yfinance and pandas are only imported once a refresh actually runs,
+    # which keeps them out of web workers that never refresh
+    import requests
+    from price_providers import default_providers, record_quotes
 
     session = requests.Session()
     session.headers['User-Agent'] = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    
-    price_data = fetch_from_yfinance(unique_symbols, session)
-    
-    failed_symbols = [s for s in unique_symbols if s not in price_data]
-    if failed_symbols:
-        finnhub_data = fetch_from_finnhub(failed_symbols, session)
-        price_data.update(finnhub_data)
+    providers = providers if providers is not None else default_providers(session)
+
+    price_data = {}
+    for provider in providers:
+        failed_symbols = [s for s in unique_symbols if s not in price_data]
+        if not failed_symbols:
+            break
+        price_data.update(provider.fetch_quotes(failed_symbols))
 
     if not price_data:
         print("Could not fetch any price data from any source.")
         return
 
+    timings['quotes'] = time.perf_counter() - started
+
+    # Only look up names that are missing or older than NAME_TTL
+    phase_started = time.perf_counter()
+    stale_before = datetime.utcnow() - NAME_TTL
+    cached = {p['symbol']: p for p in prices_collection.find({'symbol': {'$in': list(price_data)}}, {'symbol': 1, 'name_updated': 1})}
+    to_lookup = [s for s in price_data if cached.get(s, {}).get('name_updated', stale_before) <= stale_before]
+    names = {}
+    for provider in providers:
+        missing = [s for s in to_lookup if s not in names]
+        if not missing:
+            break
+        names.update(provider.fetch_names(missing))
+    timings['names'] = time.perf_counter() - phase_started
+
+    phase_started = time.perf_counter()
+    now = datetime.utcnow()
     update_operations = []
     for symbol, data in price_data.items():
-        try:
-            name = yf.Ticker(symbol, session=session).info.get('longName', symbol)
-        except:
-            name = symbol
-
-        operation = UpdateOne(
-            {'symbol': symbol},
-            {'$set': {
-                'symbol': symbol,
-                'current_price': data['current_price'],
-                'previous_close': data['previous_close'],
-                'name': name,
-                'last_updated': datetime.utcnow()
-            }},
-            upsert=True
-        )
-        update_operations.append(operation)
+        update = {'$set': {
+            'symbol': symbol,
+            'current_price': data['current_price'],
+            'previous_close': data['previous_close'],
+            'last_updated': now
+        }}
+        if symbol in names:
+            update['$set'].update({'name': names[symbol], 'name_updated': now})
+        else:
+            update['$setOnInsert'] = {'name': symbol}
+        update_operations.append(UpdateOne({'symbol': symbol}, update, upsert=True))
 
     if update_operations:
         print(f"Preparing to bulk update {len(update_operations)} price records...")
         result = prices_collection.bulk_write(update_operations)
         print(f"Bulk update complete. Matched: {result.matched_count}, Upserted: {result.upserted_count}")
+        # Tells every worker's dashboard cache that prices changed
+        bump_prices_version(database, now)
+    timings['write'] = time.perf_counter() - phase_started
+    timings['updated'] = len(update_operations)
+    timings['total'] = time.perf_counter() - started
+    timings['providers'] = [provider.stats() for provider in providers]
+
+    if PRICE_RECORD_FILE:
+        record_quotes(PRICE_RECORD_FILE, price_data, names)
+
+    print(f"Price update timing: quotes {timings['quotes']:.2f}s, names {timings['names']:.2f}s "
+          f"({len(to_lookup)} looked up, {len(price_data) - len(to_lookup)} cached), "
+          f"write {timings['write']:.2f}s, total {timings['total']:.2f}s")
+    for stats in timings['providers']:
+        print(f"  {stats['provider']}: {stats['quotes_returned']}/{stats['symbols_requested']} quotes, "
+              f"{stats['errors']} errors, {stats['latency_s']:.2f}s")
+    return timings
+
+def _json_default(value):
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+def emit_metrics(database, metrics):
+    """Prints a run's metrics as one JSON line and keeps them in price_update_runs."""
+    print(json.dumps(metrics, default=_json_default), flush=True)
+    try:
+        database.price_update_runs.insert_one(dict(metrics))
+    except PyMongoError as e:
+        print(f"Could not store price update metrics: {e}")
+
+def run_scheduled_refresh(database, markets):
+    """Refreshes the due symbols of the given markets under the price refresh lock; returns the run's status."""
+    metrics = {
+        'event': 'price_update', 'trigger': 'schedule', 'markets': sorted(m.name for m in markets),
+        'started_at': datetime.utcnow()
+    }
+    started = time.perf_counter()
+    try:
+        with LeaseLock(database.locks, PRICE_REFRESH_LOCK) as lock:
+            if not lock.acquired:
+                metrics['status'] = 'skipped'
+            else:
+                plan = plan_refresh(database, markets=markets)
+                metrics.update({'status': 'succeeded', 'due': len(plan['due']), 'fresh': plan['fresh'],
+                                'closed': plan['closed'], 'deferred': plan['deferred'], 'updated': 0})
+                if plan['due']:
+                    timings = update_stock_prices(database=database, symbols=plan['due'])
+                    if timings:
+                        metrics['updated'] = timings['updated']
+                        metrics['timings'] = {k: round(v, 3) for k, v in timings.items() if isinstance(v, float)}
+                        metrics['providers'] = timings['providers']
+                    else:
+                        metrics.update({'status': 'failed', 'error': 'No prices could be fetched.'})
+    except Exception as e:
+        metrics.update({'status': 'failed', 'error': str(e)})
+    metrics['duration_s'] = round(time.perf_counter() - started, 3)
+    emit_metrics(database, metrics)
+    return metrics['status']
+
+def run_daemon(database=None, poll_seconds=DAEMON_POLL_SECONDS):
+    """Runs the price updater until SIGTERM or SIGINT."""
+    # refresh_jobs imports this module, so it is imported here rather than at the top
+    from refresh_jobs import next_queued_job, run_refresh_job
+
+    database = database if database is not None else get_db()
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        print(f"--- [Price daemon] {signal.Signals(signum).name} received, stopping after the current run ---", flush=True)
+        stop.set()
+        # A second signal stops it right away
+        signal.signal(signum, signal.SIG_DFL)
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    ensure_indexes(database)
+    cadence = ', '.join(f"{m.name} {m.freshness.total_seconds() / 60:g}m" for m in ALL_MARKETS)
+    print(f"--- [Price daemon] Started (PID {os.getpid()}). Open-market cadence: {cadence}; "
+          f"closed markets every {CLOSED_MARKET_CADENCE.total_seconds() / 60:g}m ---", flush=True)
+
+    # Every market is refreshed once at startup
+    next_run = {market: datetime.min for market in ALL_MARKETS}
+    while not stop.is_set():
+        try:
+            job_id = next_queued_job()
+            if job_id:
+                started_at, started = datetime.utcnow(), time.perf_counter()
+                result = run_refresh_job(job_id)
+                if result:
+                    emit_metrics(database, {
+                        'event': 'price_update', 'trigger': 'manual', 'job_id': job_id, 'started_at': started_at,
+                        'status': result['status'], 'error': result.get('error'), 'timings': result.get('timings'),
+                        'duration_s': round(time.perf_counter() - started, 3)
+                    })
+                continue
+
+            now = datetime.utcnow()
+            due = [market for market, at in next_run.items() if at <= now]
+            if due:
+                status = run_scheduled_refresh(database, due)
+                finished = datetime.utcnow()
+                for market in due:
+                    is_open, _ = market_state(market, finished)
+                    if status not in ('succeeded', 'skipped'):
+                        next_run[market] = finished + RETRY_AFTER
+                    elif is_open:
+                        next_run[market] = finished + market.freshness
+                    else:
+                        next_run[market] = min(finished + CLOSED_MARKET_CADENCE, next_open(market, finished))
+        except PyMongoError as e:
+            # MongoDB being unreachable for a while shouldn't end the daemon
+            print(f"--- [Price daemon] Database error: {e} ---", flush=True)
+        stop.wait(poll_seconds)
+    print("--- [Price daemon] Stopped ---", flush=True)
 
 if __name__ == "__main__":
-    update_stock_prices()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Refresh stock prices once, or keep refreshing them with --daemon.")
+    parser.add_argument('--daemon', action='store_true', help='run the long-running price updater')
+    parser.add_argument('--force', action='store_true', help='refresh every held symbol, however fresh (single run only)')
+    args = parser.parse_args()
+    if args.daemon:
+        run_daemon()
+    else:
+        update_stock_prices(force=args.force)
\ No newline at end of file